@@ -135,6 +135,33 @@ Output:
 Provide a unified diff with refactoring improvements."""
 
 
+DEFAULT_PROMPT = "You are a helpful coding assistant."
+
+# Built once at import; looked up on every /generate request.
+_PROMPTS = {
+    'architect': ARCHITECT_PROMPT,
+    'spec_author': SPEC_AUTHOR_PROMPT,
+    'implementer': IMPLEMENTER_PROMPT,
+    'reviewer': REVIEWER_PROMPT,
+    'refiner': REFINER_PROMPT
+}
+
+# Default stop sequences per agent type, used when a request does not set its
+# own. The architect's answer is complete once its JSON block is closed, so
+# anything after the closing fence is not generated.
+#
+# llama.cpp leaves the matched stop text out of the output, so the architect's
+# reply ends without its closing fence; the orchestrator's task graph parser
+# (AgentsClient._parse_task_graph) accepts an unclosed block for this reason.
+# Any stop sequence added here must be tolerated the same way by whatever
+# parses that agent's output.
+STOP_SEQUENCES = {
+    'architect': ["\n```\n\n"]
+}
+
+AGENT_TYPES = tuple(_PROMPTS)
+
+
 def get_system_prompt(agent_type: str) -> str:
     """
     Get system prompt for specified agent type.
@@ -145,12 +172,25 @@ def get_system_prompt(agent_type: str) -> str:
     Returns:
         System prompt string
     """
-    prompts = {
-        'architect': ARCHITECT_PROMPT,
-        'spec_author': SPEC_AUTHOR_PROMPT,
-        'implementer': IMPLEMENTER_PROMPT,
-        'reviewer': REVIEWER_PROMPT,
-        'refiner': REFINER_PROMPT
-    }
+    return _PROMPTS.get(agent_type, DEFAULT_PROMPT)
+
+
+# System prompt plus the separator placed before the user prompt, so the
+# fixed part of every full prompt is assembled once rather than per request.
+_PROMPT_PREFIXES = {
+    agent_type: f"{prompt}\n\n" for agent_type, prompt in _PROMPTS.items()
+}
+_DEFAULT_PREFIX = f"{DEFAULT_PROMPT}\n\n"
+
+
+def get_prompt_prefix(agent_type: str) -> str:
+    """
+    Get the fixed prompt prefix (system prompt and separator) for an agent type.
     
-    return prompts.get(agent_type, "You are a helpful coding assistant.")
+    Args:
+        agent_type: Type of agent (architect, spec_author, implementer, reviewer, refiner)
+        
+    Returns:
+        Prefix to which the user prompt is appended
+    """
+    return _PROMPT_PREFIXES.get(agent_type, _DEFAULT_PREFIX)
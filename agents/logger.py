@@ -1,25 +1,78 @@
+import atexit
+import copy
 import logging
+import logging.handlers
+import queue
 import sys
 from rich.logging import RichHandler
 
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Background thread that writes queued log records to the real handlers
+_listener = None
+
+
+class _PassThroughQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves exceptions for the real handlers to render.
+    
+    The stock prepare() formats the traceback into the message and drops
+    exc_info, so RichHandler could no longer render it (and would parse the
+    traceback text as markup). Only the message arguments are merged here;
+    the record stays in this process, so exc_info can travel with it.
+    """
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 def setup_logging(log_level="INFO"):
     """
     Set up logging to console and file, with support for rich markup.
+
+    Loggers only enqueue records; console and file output happen on a
+    background listener thread, so logging never blocks the caller on I/O
+    (notably the inference thread while a generation is running).
     """
+    global _listener
+
     # Remove all handlers associated with the root logger object.
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+
+    # Rich styling only pays off for a human at a terminal; under Docker the
+    # output goes to a log driver, so use a plain handler there.
+    if sys.stderr.isatty():
+        console_handler = RichHandler(rich_tracebacks=True, markup=True)
+    else:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[
-            RichHandler(rich_tracebacks=True, markup=True),
-            logging.FileHandler("/tmp/agent.log"),
-        ],
+    file_handler = logging.FileHandler("/tmp/agent.log")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
     )
+    _listener.start()
+
+    logging.root.setLevel(log_level)
+    logging.root.addHandler(_PassThroughQueueHandler(log_queue))
 
     # Suppress noisy loggers
     logging.getLogger("httpx").setLevel(logging.WARNING)
-    
+
     logging.info("Agent logging initialized")
+
+
+@atexit.register
+def _stop_listener():
+    """Flush any queued records before the interpreter exits."""
+    if _listener is not None:
+        _listener.stop()
@@ -2,24 +2,49 @@
 Model loader using llama.cpp.
 """
 import logging
-from llama_cpp import Llama
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from llama_cpp import Llama, LlamaState, llama_print_system_info, llama_supports_gpu_offload
 
 logger = logging.getLogger(__name__)
 
+# GGUF general.file_type values (llama_ftype) for the common model types
+FILE_TYPES = {
+    0: 'F32', 1: 'F16', 2: 'Q4_0', 3: 'Q4_1', 7: 'Q8_0', 8: 'Q5_0', 9: 'Q5_1',
+    10: 'Q2_K', 11: 'Q3_K_S', 12: 'Q3_K_M', 13: 'Q3_K_L', 14: 'Q4_K_S',
+    15: 'Q4_K_M', 16: 'Q5_K_S', 17: 'Q5_K_M', 18: 'Q6_K', 32: 'BF16'
+}
+
+# File types that store weights unquantized
+UNQUANTIZED_FILE_TYPES = {'F32', 'F16', 'BF16'}
+
 
 class ModelLoader:
     """
     Loads and manages GGUF models via llama.cpp.
     """
     
-    def __init__(self, model_path: str, n_ctx: int = 4096, n_gpu_layers: int = 0):
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_gpu_layers: int = 0,
+                 n_threads: Optional[int] = None, n_batch: int = 512,
+                 n_ubatch: int = 512, numa: bool = False, main_gpu: int = 0,
+                 tensor_split: Optional[List[float]] = None):
         """
         Initialize model.
         
         Args:
-            model_path: Path to GGUF model file
+            model_path: Path to GGUF model file (a K-quant such as Q4_K_M is
+                recommended for CPU inference)
             n_ctx: Context window size
-            n_gpu_layers: Number of layers to offload to GPU (0 for CPU only)
+            n_gpu_layers: Number of layers to offload to GPU (0 for CPU only,
+                -1 for all layers)
+            n_threads: CPU threads used for inference (defaults to
+                llama-cpp-python's choice, half the logical CPUs)
+            n_batch: Prompt tokens submitted per decode call during prefill
+            n_ubatch: Tokens computed per physical batch; bounds how long a
+                single prefill step runs
+            numa: Spread work across NUMA nodes
+            main_gpu: GPU used for scratch buffers and small tensors
+            tensor_split: Fraction of the model placed on each GPU
         """
         logger.info(f"Loading model: {model_path}")
         
@@ -27,28 +52,158 @@ class ModelLoader:
             model_path=model_path,
             n_ctx=n_ctx,
             n_gpu_layers=n_gpu_layers,
+            main_gpu=main_gpu,
+            tensor_split=tensor_split,
+            # None keeps llama-cpp-python's default; all logical CPUs would
+            # count SMT siblings and ignore the container's CPU limit
+            n_threads=n_threads,
+            n_batch=n_batch,
+            n_ubatch=n_ubatch,
+            use_mmap=True,
+            use_mlock=False,
+            numa=numa,
             verbose=False
         )
         
+        self.file_type = self._read_file_type()
+        size_gb = os.path.getsize(model_path) / 1024**3
+        logger.info(f"Model file type: {self.file_type}, size: {size_gb:.2f} GB")
+        self._check_offload(n_gpu_layers)
+        # Shows which SIMD paths llama.cpp was built with (AVX2, AVX512_VNNI, ...)
+        logger.info(f"llama.cpp system info: {llama_print_system_info().decode().strip()}")
+        
+        # Tokenized prompt prefixes, keyed by agent type
+        self._prefix_tokens: Dict[str, List[int]] = {}
+        # Model state snapshots taken right after evaluating each prefix
+        self._states: Dict[str, LlamaState] = {}
+        # Agent type whose prefix is currently at the start of the KV cache
+        self._active_prefix: Optional[str] = None
+        
         logger.info("Model loaded successfully")
     
-    def generate(self, prompt: str, max_tokens: int = 2048, 
-                 temperature: float = 0.7, stop: list = None) -> str:
+    def _read_file_type(self) -> str:
+        """Name of the model's weight type, from the GGUF header."""
+        metadata = getattr(self.model, 'metadata', None) or {}
+        ftype = metadata.get('general.file_type')
+        if ftype is None:
+            return 'unknown'
+        return FILE_TYPES.get(int(ftype), f"ftype {ftype}")
+    
+    def _check_offload(self, n_gpu_layers: int):
+        """Warn about GPU offload that cannot help: no GPU build, or partial."""
+        if n_gpu_layers != 0 and not llama_supports_gpu_offload():
+            logger.warning(
+                f"n_gpu_layers={n_gpu_layers}, but llama.cpp was built without GPU "
+                f"support; inference runs on the CPU (rebuild with LLAMA_CMAKE_ARGS, "
+                f"e.g. -DGGML_CUDA=on, or set N_GPU_LAYERS=0)"
+            )
+            return
+        
+        metadata = getattr(self.model, 'metadata', None) or {}
+        arch = metadata.get('general.architecture')
+        n_layers = metadata.get(f"{arch}.block_count")
+        if n_layers is not None and 0 < n_gpu_layers < int(n_layers):
+            logger.warning(
+                f"Only {n_gpu_layers} of {n_layers} layers offloaded to GPU; "
+                f"per-token CPU<->GPU transfers may make this slower than "
+                f"full offload (-1) or CPU only (0)"
+            )
+    
+    def prime(self, agent_type: str, prefix: str, snapshot: bool = True):
+        """
+        Tokenize the fixed prompt prefix for an agent type, and optionally
+        evaluate and snapshot it.
+        
+        With a snapshot, later requests for this agent type restore the model
+        state instead of re-running prefill over the system prompt. Each
+        snapshot holds a copy of the logits buffer (n_batch x n_vocab
+        float32, e.g. 512 x 152k = ~300 MB) plus the prefix's KV cache.
+        
+        Args:
+            agent_type: Agent type the prefix belongs to
+            prefix: System prompt (and separator) preceding every user prompt
+            snapshot: Evaluate the prefix and keep the resulting model state
+        """
+        tokens = self.model.tokenize(prefix.encode())
+        self._prefix_tokens[agent_type] = tokens
+        if not snapshot:
+            return
+        
+        self.model.reset()
+        self.model.eval(tokens)
+        state = self.model.save_state()
+        self._states[agent_type] = state
+        self._active_prefix = agent_type
+        logger.info(
+            f"Snapshotted {len(tokens)}-token prefix for '{agent_type}' "
+            f"({(state.llama_state_size + state.scores.nbytes) / 1024**2:.0f} MB)"
+        )
+    
+    def preload_states(self, prefixes: Dict[str, str],
+                       snapshot_types: Optional[Iterable[str]] = None):
+        """
+        Prime every agent type's prompt prefix.
+        
+        Args:
+            prefixes: Prompt prefix for each agent type
+            snapshot_types: Agent types whose prefix state is snapshotted;
+                None snapshots all of them
+        """
+        snapshot_types = set(prefixes if snapshot_types is None else snapshot_types)
+        for agent_type, prefix in prefixes.items():
+            self.prime(agent_type, prefix, snapshot=agent_type in snapshot_types)
+        logger.info(f"Cached prompt prefix state for {len(self._states)} of {len(prefixes)} agent types")
+    
+    def _restore_prefix(self, agent_type: Optional[str]):
+        """
+        Restore the snapshot for an agent type's prefix, if needed.
+        
+        llama.cpp reuses the KV cache for the longest prefix shared with the
+        previous prompt, so a snapshot only has to be loaded when switching
+        between agent types.
+        """
+        if agent_type == self._active_prefix:
+            return
+        state = self._states.get(agent_type)
+        if state is not None:
+            self.model.load_state(state)
+        self._active_prefix = agent_type
+    
+    def prompt_tokens(self, agent_type: str, prefix: str, user_prompt: str) -> List[int]:
+        """
+        Build the token ids for a full prompt, reusing the cached prefix tokens.
+        
+        Args:
+            agent_type: Agent type whose primed prefix to use
+            prefix: Prefix text, tokenized only if agent_type was not primed
+            user_prompt: Prompt text following the prefix
+            
+        Returns:
+            Token ids of prefix followed by user prompt
+        """
+        tokens = self._prefix_tokens.get(agent_type)
+        if tokens is None:
+            tokens = self.model.tokenize(prefix.encode())
+        return tokens + self.model.tokenize(user_prompt.encode(), add_bos=False)
+    
+    def generate(self, prompt: Union[str, List[int]], max_tokens: int = 2048, 
+                 temperature: float = 0.7, stop: list = None,
+                 agent_type: Optional[str] = None) -> Tuple[str, Dict]:
         """
         Generate text completion.
         
         Args:
-            prompt: Input prompt
+            prompt: Input prompt, as text or token ids
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
-            stop: Stop sequences
+            stop: Stop sequences (None for no stop sequences)
+            agent_type: Agent type whose primed prefix the prompt starts with
             
         Returns:
-            Generated text
+            Tuple of generated text and llama.cpp token usage
+            (prompt_tokens, completion_tokens, total_tokens)
         """
-        if stop is None:
-            stop = []
-        
+        self._restore_prefix(agent_type)
         output = self.model(
             prompt,
             max_tokens=max_tokens,
@@ -57,4 +212,31 @@ class ModelLoader:
             echo=False
         )
         
-        return output['choices'][0]['text']
+        return output['choices'][0]['text'], output.get('usage', {})
+    
+    def generate_stream(self, prompt: Union[str, List[int]], max_tokens: int = 2048,
+                        temperature: float = 0.7, stop: list = None,
+                        agent_type: Optional[str] = None) -> Iterator[str]:
+        """
+        Generate text completion, yielding text as tokens are produced.
+        
+        Args:
+            prompt: Input prompt, as text or token ids
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            stop: Stop sequences (None for no stop sequences)
+            agent_type: Agent type whose primed prefix the prompt starts with
+            
+        Yields:
+            Generated text chunks
+        """
+        self._restore_prefix(agent_type)
+        for chunk in self.model(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stop=stop,
+            echo=False,
+            stream=True
+        ):
+            yield chunk['choices'][0]['text']
@@ -2,106 +2,631 @@
 Agent runtime service - hosts LLM inference.
 """
 import os
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict
+import json
+import asyncio
+import hashlib
+import signal
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Optional, Dict, List
 import logging
 
-from .model_loader import ModelLoader
-from .agent_prompts import get_system_prompt
+from .model_loader import UNQUANTIZED_FILE_TYPES, ModelLoader
+from .agent_prompts import AGENT_TYPES, STOP_SEQUENCES, get_prompt_prefix
 from .logger import setup_logging
 
 # Configure logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Coding Buddy Agent Runtime")
-
 # Global model loader
 model_loader = None
 
+# Why the model failed to load, if it did; the server then shuts down
+_load_error: Optional[BaseException] = None
+
+# llama.cpp is not safe for concurrent generation on one model, so every
+# inference call runs on this single worker thread, off the event loop.
+EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama")
+
+# Bounds how many requests may be running or queued for the model at once;
+# requests beyond this are rejected with 429 instead of queueing unboundedly.
+MAX_CONCURRENT = int(os.getenv('MAX_CONCURRENT', '4'))
+_inference_slots = asyncio.Semaphore(MAX_CONCURRENT)
+
+_STREAM_DONE = object()
+# Yielded by _stream_inference while a stream waits for the inference thread
+# (e.g. behind other generations); sent as an SSE comment so the client's
+# read timeout does not expire before the first token
+_STREAM_IDLE = object()
+STREAM_KEEPALIVE_SECONDS = 15.0
+
+# Largest request body accepted once gzip-decoded; a small compressed body
+# could otherwise expand to any size in memory
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(16 * 1024 * 1024)))
+
+# Most items accepted in one /generate_batch request; a batch holds the
+# inference thread for all of its items, so one request cannot take it over
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', '16'))
+
+# Responses to deterministic (temperature 0) requests, most recent last.
+# Agents frequently re-issue identical requests (e.g. retries), and these can
+# be answered without running the model again.
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+_response_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+
+# Deterministic generations currently running, keyed like the cache. Identical
+# requests arriving meanwhile wait for that result instead of queueing a
+# duplicate generation behind it.
+_in_flight: Dict[bytes, asyncio.Future] = {}
+
+# /health is polled by orchestration probes; both possible bodies are fixed
+_HEALTH_READY = b'{"status":"healthy","model_loaded":true}'
+_HEALTH_LOADING = b'{"status":"healthy","model_loaded":false}'
+_HEALTH_FAILED = b'{"status":"unhealthy","model_loaded":false}'
+
+
+class GzipRequest(Request):
+    """Request whose body is gunzipped if sent with Content-Encoding: gzip"""
+    
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                body = _gunzip(body)
+            self._body = body
+        return self._body
+
+
+def _gunzip(data: bytes) -> bytes:
+    """Decode a gzip request body, rejecting bad or oversized ones."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = decompressor.decompress(data, MAX_REQUEST_BYTES + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Request body is not valid gzip")
+    if len(body) > MAX_REQUEST_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Decompressed request body exceeds {MAX_REQUEST_BYTES} bytes"
+        )
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Request body is truncated gzip")
+    return body
+
+
+class GzipRoute(APIRoute):
+    """Route that accepts gzip-compressed request bodies"""
+    
+    def get_route_handler(self):
+        original_route_handler = super().get_route_handler()
+        
+        async def gzip_route_handler(request: Request) -> Response:
+            return await original_route_handler(GzipRequest(request.scope, request.receive))
+        
+        return gzip_route_handler
+
 
 class GenerateRequest(BaseModel):
     """Request for text generation"""
+    model_config = ConfigDict(frozen=True, strict=True, extra='forbid')
+    
     agent_type: str
     prompt: str
     max_tokens: int = 2048
     temperature: float = 0.7
-    stop: Optional[list] = None
+    stop: Optional[List[str]] = None
+    stream: bool = False
 
 
 class GenerateResponse(BaseModel):
     """Response from text generation"""
+    model_config = ConfigDict(frozen=True)
+    
     text: str
-    metadata: Dict
+    metadata: Dict[str, Any]
+
+
+class GenerateBatchRequest(BaseModel):
+    """Request for several generations in one call"""
+    model_config = ConfigDict(frozen=True, strict=True, extra='forbid')
+    
+    items: List[GenerateRequest]
+
+
+class GenerateBatchResponse(BaseModel):
+    """Responses for a batch, in request order"""
+    model_config = ConfigDict(frozen=True)
+    
+    results: List[GenerateResponse]
+
+
+# Quantizations selectable with MODEL_QUANT. 2- and 3-bit K-quants are left
+# out: their quality loss is too large for code generation.
+SUPPORTED_QUANTS = (
+    'Q4_0', 'Q4_1', 'Q4_K_S', 'Q4_K_M', 'Q5_0', 'Q5_1',
+    'Q5_K_S', 'Q5_K_M', 'Q6_K', 'Q8_0'
+)
+
 
+def _model_path() -> str:
+    """
+    Path of the model to load.
+    
+    With MODEL_QUANT set (e.g. Q4_K_M), loads base-model.<quant>.gguf;
+    otherwise base-model.gguf.
+    """
+    models_path = os.getenv('MODELS_PATH', '/models')
+    quant = os.getenv('MODEL_QUANT')
+    if not quant:
+        return f"{models_path}/base-model.gguf"
+    
+    quant = quant.upper()
+    if quant not in SUPPORTED_QUANTS:
+        raise ValueError(
+            f"Unsupported MODEL_QUANT '{quant}'; expected one of {', '.join(SUPPORTED_QUANTS)}"
+        )
+    return f"{models_path}/base-model.{quant}.gguf"
+
+
+def _tensor_split() -> Optional[List[float]]:
+    """Per-GPU model split from TENSOR_SPLIT, e.g. "0.6,0.4"."""
+    value = os.getenv('TENSOR_SPLIT')
+    if not value:
+        return None
+    return [float(part) for part in value.split(',')]
+
+
+def _snapshot_agent_types() -> Optional[List[str]]:
+    """Agent types from PREFIX_SNAPSHOTS, e.g. "architect,implementer"; None for all."""
+    value = os.getenv('PREFIX_SNAPSHOTS')
+    if value is None:
+        return None
+    agent_types = [part.strip() for part in value.split(',') if part.strip()]
+    unknown = set(agent_types) - set(AGENT_TYPES)
+    if unknown:
+        logger.warning(f"Ignoring unknown agent types in PREFIX_SNAPSHOTS: {', '.join(sorted(unknown))}")
+    return agent_types
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize model on startup"""
+
+def _load_model():
+    """Load the model; runs on the inference thread while the server is up."""
     global model_loader
     
-    model_path = os.getenv('MODELS_PATH', '/models') + '/base-model.gguf'
+    model_path = _model_path()
     logger.info(f"Loading model from {model_path}")
     
-    model_loader = ModelLoader(model_path)
+    model_kwargs = dict(
+        # The KV cache is allocated once at this size and reused by every request
+        n_ctx=int(os.getenv('N_CTX', '4096')),
+        n_threads=int(os.getenv('LLAMA_THREADS', '0')) or None,
+        n_batch=int(os.getenv('LLAMA_BATCH', '512')),
+        n_ubatch=int(os.getenv('LLAMA_UBATCH', '512')),
+        numa=os.getenv('LLAMA_NUMA', '0') == '1',
+        main_gpu=int(os.getenv('MAIN_GPU', '0')),
+        tensor_split=_tensor_split()
+    )
+    # -1 offloads every layer; llama.cpp builds without GPU support ignore it
+    n_gpu_layers = int(os.getenv('N_GPU_LAYERS', '-1'))
+    
+    try:
+        loader = ModelLoader(model_path, n_gpu_layers=n_gpu_layers, **model_kwargs)
+    except Exception as e:
+        if n_gpu_layers == 0:
+            raise
+        logger.warning(f"GPU offload failed ({e}), falling back to CPU inference")
+        loader = ModelLoader(model_path, n_gpu_layers=0, **model_kwargs)
+    
+    # Unquantized weights move 2-4x the bytes per token of a K-quant. Raising
+    # here stops the runtime (see _on_load_done), as a failed startup would.
+    if loader.file_type in UNQUANTIZED_FILE_TYPES and os.getenv('ALLOW_UNQUANTIZED') != '1':
+        raise RuntimeError(
+            f"Model {model_path} is unquantized ({loader.file_type}); use a K-quant "
+            f"such as Q4_K_M, or set ALLOW_UNQUANTIZED=1"
+        )
+    
+    # Tokenize each agent's system prompt once instead of on every request,
+    # and prefill it for the agent types chosen to keep a state snapshot
+    loader.preload_states(
+        {agent_type: get_prompt_prefix(agent_type) for agent_type in AGENT_TYPES},
+        snapshot_types=_snapshot_agent_types()
+    )
+    
+    # Publish only once fully initialized; /health reports readiness from this
+    model_loader = loader
     logger.info("Model loaded successfully")
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start loading the model in the background so the server accepts
+    connections (and answers /health) while the model is still loading.
+    """
+    loop = asyncio.get_running_loop()
+    load_task = loop.run_in_executor(EXECUTOR, _load_model)
+    load_task.add_done_callback(_on_load_done)
+    yield
+    load_task.cancel()
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+
+def _on_load_done(task):
+    """
+    Shut the server down if the model failed to load.
+    
+    Without a model the runtime can serve nothing, so it exits (as a failed
+    startup would) rather than running on and reporting the error only in
+    the log.
+    """
+    global _load_error
+    if task.cancelled() or task.exception() is None:
+        return
+    _load_error = task.exception()
+    logger.error("Model loading failed, shutting down", exc_info=_load_error)
+    # Handled by uvicorn as a normal shutdown request
+    signal.raise_signal(signal.SIGTERM)
+
+
+app = FastAPI(
+    title="Coding Buddy Agent Runtime",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+# Generated text compresses well. Clients that accept gzip (requests does by
+# default) get smaller bodies; small responses such as /health are left as is.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# Event streams must reach the client token by token, not in gzip-buffered
+# bursts. Starlette before 0.46 compresses text/event-stream too, but every
+# version leaves a response alone that already declares its encoding.
+_SSE_HEADERS = {"Content-Encoding": "identity", "Cache-Control": "no-cache"}
+# Large prompts (e.g. patch retries embedding whole files) arrive gzipped
+app.router.route_class = GzipRoute
+
+
+def _check_capacity():
+    """Reject the request if the inference queue is full."""
+    if _inference_slots.locked():
+        logger.warning("Rejecting request: %d requests already in flight", MAX_CONCURRENT)
+        raise HTTPException(status_code=429, detail="Too many concurrent generation requests")
+
+
+def _error_detail(e: Exception) -> str:
+    """
+    Error message returned to clients for a failed generation.
+    
+    Exception messages can include model paths and other server internals;
+    those are logged, and the client only gets the error type.
+    """
+    return f"Generation failed ({type(e).__name__})"
+
+
+def _log_text(label: str, text: str):
+    """
+    Log a prompt or response: in full at DEBUG, truncated at INFO.
+    
+    Checks the level first so the text is not sliced when it won't be logged.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, text)
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info("%s (first 500 chars): %s", label, text[:500])
+
+
+def _prompt_tokens(request: GenerateRequest):
+    """
+    Token ids for the agent's system prompt followed by the user prompt.
+    
+    The system prompt part is tokenized and evaluated once at load time; the
+    model restores that state instead of re-running prefill over it.
+    """
+    return model_loader.prompt_tokens(
+        request.agent_type,
+        get_prompt_prefix(request.agent_type),
+        request.prompt
+    )
+
+
+def _cache_key(request: GenerateRequest, stop) -> Optional[bytes]:
+    """Cache key for a request, or None if its output is not deterministic."""
+    if request.temperature != 0 or RESPONSE_CACHE_SIZE <= 0:
+        return None
+    key = f"{request.agent_type}|{request.max_tokens}|{stop}|{request.prompt}"
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def _cache_get(key: Optional[bytes]) -> Optional[tuple]:
+    """Look up a cached response, marking it most recently used."""
+    cached = _response_cache.get(key) if key else None
+    if cached is not None:
+        _response_cache.move_to_end(key)
+    return cached
+
+
+def _cache_put(key: bytes, value: tuple):
+    """Store a response, evicting the least recently used one when full."""
+    _response_cache[key] = value
+    _response_cache.move_to_end(key)
+    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+async def _run_inference(func):
+    """Run a blocking model call on the inference thread."""
+    async with _inference_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(EXECUTOR, func)
+
+
+async def _stream_inference(func):
+    """
+    Run a blocking token generator on the inference thread, yielding its items.
+    
+    The whole generation is one job on the inference thread, so streamed
+    requests are serialized with all other model calls.
+    """
+    async with _inference_slots:
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        
+        def produce():
+            try:
+                for item in func():
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_DONE)
+        
+        job = loop.run_in_executor(EXECUTOR, produce)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield _STREAM_IDLE
+                    continue
+                if item is _STREAM_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop generating if the client went away mid-stream
+            cancelled.set()
+            await job
+
+
 @app.post("/generate", response_model=GenerateResponse)
 async def generate(request: GenerateRequest):
     """
     Generate text using specified agent type.
+    
+    The request body may be gzip-compressed (Content-Encoding: gzip), as
+    the orchestrator does for large prompts.
+    
+    With "stream": true the response is a Server-Sent Events stream, as
+    from /generate/stream.
     """
     logger.info("Received generation request for agent: %s", request.agent_type)
     if model_loader is None:
         logger.error("Model not loaded")
         raise HTTPException(status_code=503, detail="Model not loaded")
+    if request.stream:
+        return _stream_response(request)
     
+    stop = request.stop or STOP_SEQUENCES.get(request.agent_type)
+    cache_key = _cache_key(request, stop)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        logger.info("Serving cached response for agent: %s", request.agent_type)
+        return _generate_response(request, *cached, cached=True)
+    
+    pending = _in_flight.get(cache_key) if cache_key else None
+    if pending is not None:
+        logger.info("Joining identical in-flight request for agent: %s", request.agent_type)
+        # Shielded so a disconnecting waiter cannot cancel the shared result;
+        # None means that generation failed, so fall through and run our own.
+        result = await asyncio.shield(pending)
+        if result is not None:
+            return _generate_response(request, *result, cached=True)
+    
+    _check_capacity()
+    
+    if cache_key:
+        pending = asyncio.get_running_loop().create_future()
+        _in_flight[cache_key] = pending
+    result = None
     try:
-        # Get system prompt for agent type
-        system_prompt = get_system_prompt(request.agent_type)
-        
-        # Combine system prompt with user prompt
-        full_prompt = f"{system_prompt}\n\n{request.prompt}"
-        
-        logger.info("Generating with prompt (first 500 chars): %s", full_prompt[:500])
-        logger.debug("Generating with prompt: %s", full_prompt)
+        _log_text("Generating with prompt", request.prompt)
 
         # Generate
-        response_text = model_loader.generate(
-            prompt=full_prompt,
-            max_tokens=request.max_tokens,
-            temperature=request.temperature,
-            stop=request.stop or []
+        response_text, usage = await _run_inference(
+            lambda: model_loader.generate(
+                prompt=_prompt_tokens(request),
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+                stop=stop,
+                agent_type=request.agent_type
+            )
         )
+        result = (response_text, usage)
+        if cache_key:
+            _cache_put(cache_key, result)
         
-        logger.info("Generated response (first 500 chars): %s", response_text[:500])
-        logger.debug("Generated response: %s", response_text)
-
-        return GenerateResponse(
-            text=response_text,
-            metadata={
-                'agent_type': request.agent_type,
-                'prompt_length': len(full_prompt),
-                'response_length': len(response_text)
-            }
-        )
+        _log_text("Generated response", response_text)
+
+        return _generate_response(request, response_text, usage)
         
     except Exception as e:
-        logger.error(f"Generation failed: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.exception("Generation failed: %s", e)
+        raise HTTPException(status_code=500, detail=_error_detail(e))
+    finally:
+        if cache_key:
+            _in_flight.pop(cache_key, None)
+            pending.set_result(result)
+
+
+def _generate_response(request: GenerateRequest, text: str, usage: Dict[str, int],
+                       cached: bool = False) -> GenerateResponse:
+    """Build the /generate response for a completed generation."""
+    metadata = {'agent_type': request.agent_type, **usage}
+    if cached:
+        metadata['cached'] = True
+    return GenerateResponse(text=text, metadata=metadata)
+
+
+@app.post("/generate_batch", response_model=GenerateBatchResponse)
+async def generate_batch(request: GenerateBatchRequest):
+    """
+    Generate text for several requests in one call.
+    
+    The items run back to back as a single job on the inference thread, so a
+    batch takes one queue slot and one round trip. Deterministic items are
+    answered from the response cache where possible, as with /generate, and
+    identical deterministic items in one batch are generated only once.
+    """
+    logger.info("Received batch generation request with %d items", len(request.items))
+    if model_loader is None:
+        logger.error("Model not loaded")
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has {len(request.items)} items; at most {MAX_BATCH_ITEMS} are allowed"
+        )
+    if any(item.stream for item in request.items):
+        raise HTTPException(status_code=400, detail="Batch items cannot be streamed")
+    
+    stops = [item.stop or STOP_SEQUENCES.get(item.agent_type) for item in request.items]
+    keys = [_cache_key(item, stop) for item, stop in zip(request.items, stops)]
+    results = [_cache_get(key) for key in keys]
+    pending = []
+    # Index of a repeated deterministic item -> the item generated for it
+    duplicates = {}
+    first_with_key = {}
+    for i, result in enumerate(results):
+        if result is not None:
+            continue
+        if keys[i] in first_with_key:
+            duplicates[i] = first_with_key[keys[i]]
+            continue
+        if keys[i]:
+            first_with_key[keys[i]] = i
+        pending.append(i)
+    
+    if pending:
+        _check_capacity()
+        
+        def run_batch():
+            return [
+                model_loader.generate(
+                    prompt=_prompt_tokens(request.items[i]),
+                    max_tokens=request.items[i].max_tokens,
+                    temperature=request.items[i].temperature,
+                    stop=stops[i],
+                    agent_type=request.items[i].agent_type
+                )
+                for i in pending
+            ]
+        
+        try:
+            generated = await _run_inference(run_batch)
+        except Exception as e:
+            logger.exception("Batch generation failed: %s", e)
+            raise HTTPException(status_code=500, detail=_error_detail(e))
+        
+        for i, result in zip(pending, generated):
+            results[i] = result
+            if keys[i]:
+                _cache_put(keys[i], result)
+        for i, original in duplicates.items():
+            results[i] = results[original]
+    
+    generated_items = set(pending)
+    return GenerateBatchResponse(results=[
+        _generate_response(item, *result, cached=i not in generated_items)
+        for i, (item, result) in enumerate(zip(request.items, results))
+    ])
+
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    """
+    Generate text using specified agent type, streamed as Server-Sent Events.
+    
+    Each event carries one chunk of generated text as {"token": "..."}.
+    """
+    logger.info("Received streaming generation request for agent: %s", request.agent_type)
+    if model_loader is None:
+        logger.error("Model not loaded")
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return _stream_response(request)
+
+
+def _stream_response(request: GenerateRequest) -> StreamingResponse:
+    """Start a generation whose tokens are sent as Server-Sent Events."""
+    _check_capacity()
+    
+    logger.debug("Streaming with prompt: %s", request.prompt)
+    
+    async def events():
+        try:
+            async for token in _stream_inference(
+                lambda: model_loader.generate_stream(
+                    prompt=_prompt_tokens(request),
+                    max_tokens=request.max_tokens,
+                    temperature=request.temperature,
+                    stop=request.stop or STOP_SEQUENCES.get(request.agent_type),
+                    agent_type=request.agent_type
+                )
+            ):
+                if token is _STREAM_IDLE:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+        except Exception as e:
+            logger.exception("Streaming generation failed: %s", e)
+            yield f"event: error\ndata: {json.dumps({'detail': _error_detail(e)})}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    return {
-        'status': 'healthy',
-        'model_loaded': model_loader is not None
-    }
+    if _load_error is not None:
+        return Response(content=_HEALTH_FAILED, status_code=503, media_type="application/json")
+    return Response(
+        content=_HEALTH_READY if model_loader is not None else _HEALTH_LOADING,
+        media_type="application/json"
+    )
 
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host='0.0.0.0', port=8000)
+    # One worker: each process would load its own copy of the model. Requests
+    # are logged by the application, so uvicorn's access log is disabled.
+    uvicorn.run(
+        app,
+        host='0.0.0.0',
+        port=8000,
+        loop='uvloop',
+        http='httptools',
+        workers=1,
+        access_log=False
+    )
+    if _load_error is not None:
+        sys.exit(1)
@@ -0,0 +1,46 @@
+import gzip
+
+import pytest
+from fastapi import HTTPException
+
+from agents import runtime
+
+
+@pytest.fixture
+def small_request_limit(monkeypatch):
+    monkeypatch.setattr(runtime, 'MAX_REQUEST_BYTES', 1024)
+
+
+def test_gunzip_decodes_body():
+    body = b'{"agent_type": "implementer", "prompt": "hi"}'
+
+    assert runtime._gunzip(gzip.compress(body)) == body
+
+
+def test_gunzip_rejects_truncated_body():
+    data = gzip.compress(b'x' * 1000)
+
+    with pytest.raises(HTTPException) as error:
+        runtime._gunzip(data[:-8])
+
+    assert error.value.status_code == 400
+
+
+def test_gunzip_rejects_invalid_body():
+    with pytest.raises(HTTPException) as error:
+        runtime._gunzip(b'this is not gzip')
+
+    assert error.value.status_code == 400
+
+
+def test_gunzip_rejects_body_over_limit(small_request_limit):
+    with pytest.raises(HTTPException) as error:
+        runtime._gunzip(gzip.compress(b'x' * 1025))
+
+    assert error.value.status_code == 413
+
+
+def test_gunzip_accepts_body_at_limit(small_request_limit):
+    body = b'x' * 1024
+
+    assert runtime._gunzip(gzip.compress(body)) == body
@@ -4,10 +4,89 @@ Client for communicating with agent runtime.
 import requests
 import logging
 import json
-from typing import Dict, Optional
+import gzip
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from jsonschema import Draft7Validator, ValidationError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    _json_loads = json.loads
 
 logger = logging.getLogger(__name__)
 
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+# Streamed events must arrive as they are sent, not held in a gzip buffer
+_STREAM_HEADERS = {**_JSON_HEADERS, 'Accept-Encoding': 'identity'}
+
+# Request bodies above this size (retry prompts carry whole files) are sent
+# gzipped; the runtime decodes them
+_GZIP_MIN_BODY_BYTES = 4096
+
+
+def _encode_body(body: bytes, headers: Dict[str, str]) -> Tuple[bytes, Dict[str, str]]:
+    """Gzip a large request body, returning the body and headers to send."""
+    if len(body) <= _GZIP_MIN_BODY_BYTES:
+        return body, headers
+    # Fastest level: prompt text still shrinks several times over
+    return gzip.compress(body, compresslevel=1), {**headers, 'Content-Encoding': 'gzip'}
+
+
+# First fenced code block in an agent response, optionally tagged as JSON. An
+# unclosed fence, as left when the closing fence is the stop sequence, runs to
+# the end.
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*\n?(.*?)(?:```|\Z)", re.DOTALL)
+
+# Body of the first fenced code block (```diff or any other tag). An unclosed
+# fence, as left by a generation cut off at max_tokens, runs to the end.
+_CODE_FENCE_RE = re.compile(r"```[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+
+# Header lines of a unified diff: the new-file name and each hunk's claimed
+# original line range
+_DIFF_FILE_RE = re.compile(r"\+\+\+\s+b/(\S+)")
+_HUNK_HEADER_RE = re.compile(r"@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+
+# Shape of the Architect's task graph; compiled once, checked on every plan
+_TASK_GRAPH_VALIDATOR = Draft7Validator({
+    'type': 'object',
+    'required': ['tasks'],
+    'properties': {
+        'language': {'type': 'string'},
+        'tasks': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['id', 'description', 'acceptance_criteria'],
+                'properties': {
+                    'id': {'type': ['integer', 'string']},
+                    'description': {'type': 'string'},
+                    'acceptance_criteria': {'type': 'array', 'items': {'type': 'string'}},
+                    # Ids of earlier tasks; the state machine compares them as strings
+                    'dependencies': {'type': 'array', 'items': {'type': ['integer', 'string']}}
+                }
+            }
+        }
+    }
+})
+
+
+def _count_lines(text: str) -> int:
+    """Number of lines in text, without building a list of them."""
+    return text.count('\n') + (1 if text and not text.endswith('\n') else 0)
+
 
 class AgentsClient:
     """
@@ -17,8 +96,112 @@ class AgentsClient:
     
     AGENT_RUNTIME_URL = "http://agent-runtime:8000"
     
-    def __init__(self):
-        self.base_url = self.AGENT_RUNTIME_URL
+    # Largest part of a file read into a patch-retry prompt
+    MAX_CONTEXT_FILE_BYTES = 256_000
+    # Files up to this many lines go into a patch-retry prompt whole; longer
+    # ones are cut down to the regions the broken hunks were aimed at
+    FULL_CONTEXT_MAX_LINES = 400
+    
+    # Consecutive failed calls, after retries, that mark the runtime as down;
+    # further calls then fail fast until the cooldown has passed
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_COOLDOWN_SECONDS = 30.0
+    
+    # Fixed prompt text. Prompts put these ahead of any per-call data: the
+    # runtime reuses the evaluated state for the longest prefix shared with
+    # the previous prompt, so a common static opening is not re-evaluated.
+    ARCHITECT_PREAMBLE = """Please decompose the following user request into a task graph.
+Remember to follow all the instructions from your system prompt precisely. Your response must be a markdown document with a single JSON code block containing the task graph.
+"""
+    
+    # Role line and diff formatting instructions opening every implementer prompt
+    IMPLEMENTER_PREAMBLE = """You are an expert software engineer.
+
+**CRITICAL INSTRUCTIONS FOR DIFF FORMATTING:**
+-   Your output MUST be a **pure unified diff**. Do NOT include any comments, introductory text, blank lines, or any other content outside the strict diff format. The diff MUST start directly with `---`.
+-   If implementing changes across **multiple files**, concatenate their individual unified diffs directly, one after another, without any intervening comments or blank lines.
+"""
+    
+    REFINER_PROMPT = """You are an expert in code refactoring. Improve the code structure without changing behavior.
+
+Focus on:
+- Naming clarity
+- Function decomposition
+- Code organization
+
+Provide a unified diff with refactoring changes."""
+    
+    def __init__(self, base_url: Optional[str] = None, temperature: float = 0.7,
+                 cache_size: int = 128, concurrency: int = 1, timeout: float = 300):
+        """
+        Args:
+            base_url: Agent runtime URL; defaults to the AGENT_RUNTIME_URL
+                environment variable, then to the docker-compose service
+            temperature: Sampling temperature for agent calls
+            cache_size: Responses kept for repeated deterministic
+                (temperature 0) calls; 0 disables the cache
+            concurrency: Maximum agent calls in flight when dispatching
+                independent tasks; keep at or below the runtime's
+                MAX_CONCURRENT so calls are not rejected
+            timeout: Seconds to wait for the runtime to send data; a call
+                queued behind other generations receives nothing but
+                keep-alives until its own generation starts
+        """
+        self.base_url = base_url or os.getenv('AGENT_RUNTIME_URL', self.AGENT_RUNTIME_URL)
+        self.temperature = temperature
+        self.concurrency = concurrency
+        self.timeout = timeout
+        
+        # Deterministic calls with an identical payload get the same answer,
+        # so repeats are served locally without a round trip to the runtime
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[bytes, Dict]" = OrderedDict()
+        self.stats = {'cache_hits': 0, 'cache_misses': 0}
+        
+        # One session per client: agent calls reuse pooled keep-alive
+        # connections instead of opening a new one each time
+        self._session = requests.Session()
+        # Transient failures are retried here, so they don't cost a whole new
+        # generation in the orchestrator's retry loop. Agent calls are POSTs,
+        # which urllib3 does not retry unless allowed explicitly. Only
+        # failures where no generation ran are retried: connection errors and
+        # gateway/unavailable statuses (e.g. 503 while the model loads), and
+        # 429 when the runtime's inference slots are all taken. A 500
+        # is a failed generation that would fail again, and a read timeout
+        # leaves the original generation running on the runtime's single
+        # inference thread, so a re-POST would only queue behind it.
+        # Status retries wait 0, 2, 4, 8, 16 and 32s: about a minute in all,
+        # long enough to outlast a model load rather than give up during it.
+        retry = Retry(
+            total=6,
+            connect=3,
+            read=0,
+            other=0,
+            backoff_factor=1,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=('POST',),
+            # Hand back the last response once retries run out, so its status
+            # surfaces through raise_for_status as an HTTPError
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        
+        # Circuit breaker state: once the runtime keeps failing, calls are
+        # refused locally instead of each waiting out its own retries
+        self._fail_streak = 0
+        self._circuit_open_until = 0.0
+    
+    def close(self):
+        """Close pooled connections to the agent runtime."""
+        self._session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def plan(self, request: str, codebase_summary: Dict) -> Dict:
         """
@@ -56,31 +239,29 @@ class AgentsClient:
         """Call Implementer agent to generate code."""
         logger.info(f"Calling Implementer agent for task: {task['id']}")
         
-        response = self._call_agent(
+        return self._call_agent_for_diff(
             agent_type="implementer",
             prompt=self._build_implementer_prompt(task)
         )
+    
+    def implement_many(self, tasks: List[Dict], max_workers: Optional[int] = None) -> List[str]:
+        """
+        Call Implementer agent for several independent tasks concurrently.
         
-        raw_text = response.get('text', '')
+        Args:
+            tasks: Tasks that do not depend on each other's changes
+            max_workers: Maximum calls in flight; defaults to the client's
+                concurrency
         
-        # The implementer can sometimes wrap the diff in markdown.
-        # We need to extract just the raw diff.
-        if '```diff' in raw_text:
-            try:
-                return raw_text.split('```diff')[1].split('```')[0].strip()
-            except IndexError:
-                # Fallback for malformed markdown
-                pass
-        
-        if '```' in raw_text:
-            try:
-                # Generic fallback for any fenced code block
-                return raw_text.split('```')[1].split('```')[0].strip()
-            except IndexError:
-                pass
-
-        # If no markers are found, assume the whole response is the diff
-        return raw_text.strip()
+        Returns:
+            Diffs, in the same order as tasks
+        """
+        if not tasks:
+            return []
+        
+        max_workers = max_workers or self.concurrency
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+            return list(pool.map(self.implement, tasks))
     
     def review(self, validation_result: Dict) -> Dict:
         """
@@ -107,62 +288,213 @@ class AgentsClient:
         """
         logger.info("Calling Refiner agent for refactoring")
         
-        response = self._call_agent(
+        return self._call_agent_for_diff(
             agent_type="refiner",
             prompt=self._build_refiner_prompt()
         )
+    
+    def _call_agent_for_diff(self, agent_type: str, prompt: str) -> str:
+        """
+        Call an agent whose answer is a diff, and return just the diff.
         
-        return response.get('text', '')
+        The response is streamed, so reading can stop as soon as the fenced
+        diff is complete rather than after the whole body has arrived.
+        """
+        with closing(self._call_agent_stream(agent_type=agent_type, prompt=prompt)) as chunks:
+            raw_text = self._read_until_fenced_block(chunks)
+        
+        # The agent can sometimes wrap the diff in markdown.
+        # We need to extract just the raw diff.
+        match = _CODE_FENCE_RE.search(raw_text)
+        if match:
+            return match.group(1).strip()
+
+        # If no markers are found, assume the whole response is the diff
+        return raw_text.strip()
     
     def _call_agent(self, agent_type: str, prompt: str, 
-                    max_tokens: int = 2048, temperature: float = 0.7) -> Dict:
+                    max_tokens: int = 2048, temperature: Optional[float] = None) -> Dict:
         """
         Make HTTP request to agent runtime.
         """
-        logger.debug("Calling agent '%s' with prompt:\n%s", agent_type, prompt)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Calling agent '%s' with prompt:\n%s", agent_type, prompt)
 
+        if temperature is None:
+            temperature = self.temperature
         payload = {
             'agent_type': agent_type,
             'prompt': prompt,
             'max_tokens': max_tokens,
             'temperature': temperature
         }
+        body = _json_dumps(payload)
+        
+        cache_key = None
+        if temperature <= 0 and self._cache_size > 0:
+            cache_key = hashlib.sha256(body).digest()
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self.stats['cache_hits'] += 1
+                logger.debug("Serving cached response for agent '%s'", agent_type)
+                return cached
+            self.stats['cache_misses'] += 1
         
+        self._check_circuit()
+        data, headers = _encode_body(body, _JSON_HEADERS)
         try:
-            response = requests.post(
+            response = self._session.post(
                 f"{self.base_url}/generate",
-                json=payload,
-                timeout=300
+                data=data,
+                headers=headers,
+                timeout=self.timeout
             )
             response.raise_for_status()
+            self._fail_streak = 0
+            
+            response_json = _json_loads(response.content)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Agent '%s' returned response:\n%s", agent_type, response_json.get('text', ''))
             
-            response_json = response.json()
-            logger.debug("Agent '%s' returned response:\n%s", agent_type, response_json.get('text', ''))
+            if cache_key is not None:
+                self._cache[cache_key] = response_json
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
             return response_json
             
         except requests.exceptions.RequestException as e:
-            logger.error(f"Agent call failed: {e}")
+            logger.error("Agent call failed: %s", e)
+            self._record_failure(e)
+            raise
+        except ValueError as e:
+            logger.error("Agent call failed: %s", e)
             raise
     
+    def _call_agent_stream(self, agent_type: str, prompt: str,
+                           max_tokens: int = 2048,
+                           temperature: Optional[float] = None) -> Iterator[str]:
+        """
+        Stream generated text from agent runtime as it is produced.
+        
+        Closing the generator before the end closes the connection, which
+        stops the generation on the runtime.
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Streaming agent '%s' with prompt:\n%s", agent_type, prompt)
+
+        if temperature is None:
+            temperature = self.temperature
+        payload = {
+            'agent_type': agent_type,
+            'prompt': prompt,
+            'max_tokens': max_tokens,
+            'temperature': temperature
+        }
+        self._check_circuit()
+        data, headers = _encode_body(_json_dumps(payload), _STREAM_HEADERS)
+        
+        try:
+            with self._session.post(
+                f"{self.base_url}/generate/stream",
+                data=data,
+                headers=headers,
+                timeout=self.timeout,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                self._fail_streak = 0
+                
+                # Server-Sent Events: "data: {...}" lines, optionally preceded
+                # by "event: error"; a blank line ends each event
+                event = None
+                for line in response.iter_lines():
+                    if not line:
+                        event = None
+                    elif line.startswith(b'event:'):
+                        event = line[6:].strip()
+                    elif line.startswith(b'data:'):
+                        data = _json_loads(line[5:])
+                        if event == b'error':
+                            raise RuntimeError(f"Agent generation failed: {data.get('detail')}")
+                        yield data['token']
+            
+        except requests.exceptions.RequestException as e:
+            logger.error("Agent call failed: %s", e)
+            self._record_failure(e)
+            raise
+        except ValueError as e:
+            logger.error("Agent call failed: %s", e)
+            raise
+    
+    def _check_circuit(self):
+        """Fail fast while the runtime is considered down."""
+        if self._fail_streak >= self.CIRCUIT_FAILURE_THRESHOLD:
+            remaining = self._circuit_open_until - time.monotonic()
+            if remaining > 0:
+                raise requests.exceptions.ConnectionError(
+                    f"Agent runtime unavailable after {self._fail_streak} failed calls; "
+                    f"not retrying for another {remaining:.0f}s"
+                )
+    
+    def _record_failure(self, error: requests.exceptions.RequestException):
+        """
+        Count a failed call, opening the circuit at the threshold.
+        
+        Only failures that suggest the runtime is down count: connection
+        errors, timeouts and 5xx responses. A 4xx (e.g. 422 for a bad request
+        or 429 while busy) comes from a runtime that is up.
+        """
+        response = getattr(error, 'response', None)
+        if response is not None and response.status_code < 500:
+            return
+        self._fail_streak += 1
+        if self._fail_streak >= self.CIRCUIT_FAILURE_THRESHOLD:
+            self._circuit_open_until = time.monotonic() + self.CIRCUIT_COOLDOWN_SECONDS
+            logger.warning(
+                "Agent runtime failed %d calls in a row; refusing calls for %.0fs",
+                self._fail_streak, self.CIRCUIT_COOLDOWN_SECONDS
+            )
+    
+    def _read_until_fenced_block(self, chunks: Iterable[str]) -> str:
+        """
+        Join streamed text, stopping once a fenced code block has closed.
+        
+        Anything the model writes after the block is not needed, so there is
+        no point waiting for it to be generated.
+        """
+        parts = []
+        fences = 0
+        carry = ''
+        
+        for chunk in chunks:
+            parts.append(chunk)
+            # A fence can be split across chunks, so rescan the last two
+            # characters of the previous chunk unless they ended a fence
+            window = carry + chunk
+            fences += window.count('```')
+            if fences >= 2:
+                break
+            carry = '' if window.endswith('```') else window[-2:]
+        
+        return ''.join(parts)
+    
     def _build_architect_prompt(self, request: str, codebase_summary: Dict) -> str:
         """Build prompt for Architect agent"""
-        return f"""Please decompose the following user request into a task graph.
-
+        return f"""{self.ARCHITECT_PREAMBLE}
 **User Request**: {request}
 
 **Codebase Summary**:
 - Files: {codebase_summary['file_count']}
 - Modules: {len(codebase_summary['modules'])}
 - Build Targets: {len(codebase_summary['build_targets'])}
-
-Remember to follow all the instructions from your system prompt precisely. Your response must be a markdown document with a single JSON code block containing the task graph.
 """
     
     def _build_test_author_prompt(self, task_graph: Dict) -> str:
         """Build prompt for Spec Author agent"""
         tasks = task_graph.get('tasks', [])
         language = task_graph.get("language")
-        task_descriptions = "\n".join([f"- {t['description']}" for t in tasks])
+        task_descriptions = "\n".join(f"- {t['description']}" for t in tasks)
 
         if not language:
             logger.warning("Language not found in task graph. Test generation might be inaccurate.")
@@ -190,41 +522,71 @@ Generate a complete test file with all necessary imports and boilerplate.
         """Build prompt for Implementer agent"""
         feedback_context = task.get('feedback')
         suggestions = task.get('suggestions')
-
-        # Base instructions for diff formatting
-        diff_formatting_instructions = """
-**CRITICAL INSTRUCTIONS FOR DIFF FORMATTING:**
--   Your output MUST be a **pure unified diff**. Do NOT include any comments, introductory text, blank lines, or any other content outside the strict diff format. The diff MUST start directly with `---`.
--   If implementing changes across **multiple files**, concatenate their individual unified diffs directly, one after another, without any intervening comments or blank lines.
-"""
+        criteria_block = self._criteria_block(task)
 
         # Prioritize patch failure feedback if present, otherwise use reviewer suggestions
         if feedback_context:
             # This is a retry after a patch application failure
             file_contexts = feedback_context.get('file_contexts', [])
             
-            file_context_str = ""
             if file_contexts:
-                file_context_str += "**Context for files relevant to this failed patch:**\n"
+                hunks = self._diff_hunks(feedback_context['broken_diff'])
+                
+                # Collected and joined once: file contents can be large, and
+                # repeated += would copy everything accumulated so far
+                parts = ["**Context for files relevant to this failed patch:**\n"]
                 for file_info in file_contexts:
-                    file_context_str += f"- File: `{file_info['filename']}`\n"
+                    parts.append(f"- File: `{file_info['filename']}`\n")
                     if file_info['exists']:
-                        file_context_str += f"  - Status: EXISTS, {file_info['num_lines']} lines\n"
-                        file_context_str += "  --- START FILE CONTENT ---\n"
-                        file_context_str += f"{file_info['content']}\n"
-                        file_context_str += "  --- END FILE CONTENT ---\n"
+                        content, truncated = self._read_file_capped(file_info['path'])
+                        num_lines = _count_lines(content)
+                        if truncated:
+                            parts.append(f"  - Status: EXISTS, over {self.MAX_CONTEXT_FILE_BYTES} bytes; only the first {num_lines} lines are shown\n")
+                        else:
+                            parts.append(f"  - Status: EXISTS, {num_lines} lines\n")
+                        # Long files are cut down to where the broken hunks
+                        # belong, found from their context lines
+                        file_hunks = hunks.get(file_info['filename'])
+                        excerpts = ''
+                        if file_hunks and num_lines > self.FULL_CONTEXT_MAX_LINES:
+                            excerpts = self._file_excerpts(content, file_hunks)
+                            if not excerpts:
+                                # Every hunk lies past the end of what was
+                                # read (e.g. beyond a truncated read); show
+                                # the start of the file rather than all of it
+                                excerpts = self._file_excerpts(
+                                    content, [(1, self.FULL_CONTEXT_MAX_LINES, [])], context=0
+                                )
+                        if excerpts:
+                            parts.append("  --- START FILE EXCERPTS (line numbers are not part of the file) ---\n")
+                            parts.append(excerpts)
+                            parts.append("  --- END FILE EXCERPTS ---\n")
+                        else:
+                            parts.append("  --- START FILE CONTENT ---\n")
+                            parts.append(f"{content}\n")
+                            parts.append("  --- END FILE CONTENT ---\n")
                     else:
-                        file_context_str += "  - Status: DOES NOT EXIST (You should create it with the correct diff format)\n"
+                        parts.append("  - Status: DOES NOT EXIST (You should create it with the correct diff format)\n")
+                file_context_str = "".join(parts)
             else:
                 file_context_str = "Could not automatically determine files relevant to this patch failure."
 
-            return f"""You are an expert software engineer specializing in fixing diff application errors.
+            return f"""{self.IMPLEMENTER_PREAMBLE}
+You specialize in fixing diff application errors.
 Your previous attempt to generate a diff for the following task failed to apply to the codebase.
 
+**Instructions:**
+Analyze the error message, the actual file content (if provided), and the original task. The `patch` error, combined with the file's current state, should tell you exactly what is wrong.
+
+Generate a **new, corrected unified diff** that fixes the problem.
+- If the file exists, ensure your diff's context lines (`-`, `+`, ` `) EXACTLY match the provided file content.
+- If the file does not exist, ensure you are using the correct "new file" diff format.
+Include only the minimal necessary changes.
+
 **Original Task:** {task['description']}
 
 **Acceptance Criteria:**
-{chr(10).join([f"- {c}" for c in task['acceptance_criteria']])}
+{criteria_block}
 
 **Error Message from the `patch` command:**
 {feedback_context['patch_error']}
@@ -235,54 +597,191 @@ Your previous attempt to generate a diff for the following task failed to apply
 ```diff
 {feedback_context['broken_diff']}
 ```
-{diff_formatting_instructions}
-**Instructions:**
-Analyze the error message, the actual file content (if provided), and the original task. The `patch` error, combined with the file's current state, should tell you exactly what is wrong.
-
-Generate a **new, corrected unified diff** that fixes the problem.
-- If the file exists, ensure your diff's context lines (`-`, `+`, ` `) EXACTLY match the provided file content.
-- If the file does not exist, ensure you are using the correct "new file" diff format.
-Include only the minimal necessary changes.
 """
         elif suggestions:
             # This is a retry after general validation failure with reviewer suggestions
-            return f"""You are an expert software engineer. Your previous implementation for the following task failed validation.
+            suggestion_lines = "\n".join(f"- {s}" for s in suggestions)
+            return f"""{self.IMPLEMENTER_PREAMBLE}
+Your previous implementation for the following task failed validation.
+
+**Instructions:**
+Based on the reviewer's feedback, provide a new unified diff to correct the implementation.
+Include only the minimal necessary changes to address the suggestions.
 
 **Original Task:** {task['description']}
 
 **Acceptance Criteria:**
-{chr(10).join([f"- {c}" for c in task['acceptance_criteria']])}
+{criteria_block}
 
 **Reviewer Suggestions for Improvement:**
-{chr(10).join([f"- {s}" for s in suggestions])}
-{diff_formatting_instructions}
-**Instructions:**
-Based on the reviewer's feedback, provide a new unified diff to correct the implementation.
-Include only the minimal necessary changes to address the suggestions.
+{suggestion_lines}
 """
         else:
             # This is the first attempt
-            return f"""You are an expert software engineer. Implement this task.
+            return f"""{self.IMPLEMENTER_PREAMBLE}
+Implement the following task. Provide a unified diff that implements it.
+Include only the minimal necessary changes.
 
 Task: {task['description']}
 
 Acceptance Criteria:
-{chr(10).join([f"- {c}" for c in task['acceptance_criteria']])}
+{criteria_block}
 
 Context:
 {task.get('context', 'No additional context')}
-{diff_formatting_instructions}
-Provide a unified diff that implements this task.
-Include only the minimal necessary changes."""
+"""
+    
+    def _read_file_capped(self, path: str) -> Tuple[str, bool]:
+        """
+        Read a file for prompt context, up to MAX_CONTEXT_FILE_BYTES.
+        
+        Returns:
+            The text read, and whether the file was longer than the cap
+        """
+        with open(path, 'rb') as f:
+            data = f.read(self.MAX_CONTEXT_FILE_BYTES + 1)
+        truncated = len(data) > self.MAX_CONTEXT_FILE_BYTES
+        if truncated:
+            # Cut at the last full line so no partial line is shown
+            end = data.rfind(b'\n', 0, self.MAX_CONTEXT_FILE_BYTES) + 1
+            data = data[:end or self.MAX_CONTEXT_FILE_BYTES]
+        return data.decode('utf-8', errors='replace'), truncated
+    
+    def _diff_hunks(self, diff: str) -> Dict[str, List[Tuple[int, int, List[str]]]]:
+        """
+        Original-file location and lines of each file's hunks in a diff.
+        
+        Returns:
+            (claimed start line, line count, original lines) of every hunk,
+            keyed by file name; the original lines are the hunk's context
+            and removed lines
+        """
+        hunks: Dict[str, List[Tuple[int, int, List[str]]]] = {}
+        current = None
+        old_lines = None
+        remaining = 0
+        
+        for line in diff.splitlines():
+            file_match = _DIFF_FILE_RE.match(line)
+            if file_match:
+                current = hunks.setdefault(file_match.group(1), [])
+                old_lines = None
+                continue
+            hunk_match = _HUNK_HEADER_RE.match(line)
+            if hunk_match:
+                if current is not None:
+                    count = hunk_match.group(2)
+                    remaining = int(count) if count is not None else 1
+                    old_lines = []
+                    current.append((int(hunk_match.group(1)), remaining, old_lines))
+                continue
+            if old_lines is None or remaining <= 0:
+                continue
+            if line.startswith(('diff ', '--- ')):
+                # Next file's headers; the hunk was shorter than it claimed
+                old_lines = None
+            elif line.startswith((' ', '-')):
+                old_lines.append(line[1:])
+                remaining -= 1
+            elif not line:
+                # Blank context line with its leading space dropped
+                old_lines.append('')
+                remaining -= 1
+        
+        return hunks
+    
+    def _locate_hunk(self, lines: List[str], start: int, old_lines: List[str]) -> int:
+        """
+        Where a hunk's original lines actually are in a file.
+        
+        A patch that failed to apply often has wrong line numbers, so the
+        hunk is placed where most of its context and removed lines match,
+        nearest the claimed start on ties. The claimed start is kept if none
+        of them occur in the file.
+        
+        Returns:
+            1-based start line
+        """
+        wanted = [(offset, text.strip()) for offset, text in enumerate(old_lines) if text.strip()]
+        if not wanted:
+            return start
+        
+        positions: Dict[str, List[int]] = {}
+        for index, text in enumerate(lines):
+            positions.setdefault(text.strip(), []).append(index)
+        
+        # Each matching line votes for the start it implies
+        votes: Dict[int, int] = {}
+        for offset, text in wanted:
+            for index in positions.get(text, ()):
+                implied = index - offset + 1
+                votes[implied] = votes.get(implied, 0) + 1
+        if not votes:
+            return start
+        
+        return max(votes, key=lambda candidate: (votes[candidate], -abs(candidate - start)))
+    
+    def _file_excerpts(self, content: str, hunks: List[Tuple[int, int, List[str]]],
+                       context: int = 40) -> str:
+        """
+        Line-numbered excerpts of a file around the given hunks.
+        
+        Each hunk is placed by its original lines (see _locate_hunk) and
+        widened by context lines on both sides; overlapping windows are
+        merged and gaps between them are marked with "...".
+        """
+        lines = content.splitlines()
+        
+        located = [
+            (self._locate_hunk(lines, start, old_lines), count)
+            for start, count, old_lines in hunks
+        ]
+        
+        windows = []
+        for start, count in sorted(located):
+            low = max(1, start - context)
+            high = min(len(lines), start + max(count, 1) - 1 + context)
+            if low > high:
+                # Hunk lies past the end of the file
+                continue
+            if windows and low <= windows[-1][1] + 1:
+                windows[-1][1] = max(windows[-1][1], high)
+            else:
+                windows.append([low, high])
+        
+        parts = []
+        for low, high in windows:
+            if low > 1:
+                parts.append("...\n")
+            for number in range(low, high + 1):
+                parts.append(f"{number:>6}| {lines[number - 1]}\n")
+        if windows and windows[-1][1] < len(lines):
+            parts.append("...\n")
+        
+        return "".join(parts)
+    
+    def _criteria_block(self, task: Dict) -> str:
+        """
+        Acceptance criteria as a bullet list.
+        
+        Stored on the task so implementer retries reuse it instead of
+        rebuilding it for every prompt.
+        """
+        block = task.get('_criteria_block')
+        if block is None:
+            block = "\n".join(f"- {c}" for c in task['acceptance_criteria'])
+            task['_criteria_block'] = block
+        return block
     
     def _build_reviewer_prompt(self, validation_result: Dict) -> str:
         """Build prompt for Reviewer agent"""
         failures = validation_result.get('failures', [])
+        failure_lines = "\n".join(f"- {f}" for f in failures)
         
         return f"""You are an expert code reviewer. Analyze these test failures and suggest fixes.
 
 Test Failures:
-{chr(10).join([f"- {f}" for f in failures])}
+{failure_lines}
 
 Coverage: {validation_result.get('coverage', 'N/A')}%
 
@@ -290,14 +789,7 @@ Suggest specific corrective actions or recommend rollback."""
     
     def _build_refiner_prompt(self) -> str:
         """Build prompt for Refiner agent"""
-        return """You are an expert in code refactoring. Improve the code structure without changing behavior.
-
-Focus on:
-- Naming clarity
-- Function decomposition
-- Code organization
-
-Provide a unified diff with refactoring changes."""
+        return self.REFINER_PROMPT
     
     def _parse_task_graph(self, response: Dict) -> Dict:
         """Parse task graph from agent response"""
@@ -305,17 +797,21 @@ Provide a unified diff with refactoring changes."""
         
         try:
             # Remove markdown code blocks if present
-            if '```json' in text:
-                text = text.split('```json')[1].split('```')[0]
-            elif '```' in text:
-                text = text.split('```')[1].split('```')[0]
+            match = _JSON_FENCE_RE.search(text)
+            payload = match.group(1) if match else text
             
-            return json.loads(text.strip())
-        except (json.JSONDecodeError, IndexError) as e:
-            logger.error(f"Failed to parse task graph: {e}")
-            logger.debug("Full response text was:\n%s", text)
-            # Return minimal valid structure
-            return {'tasks': []}
+            task_graph = _json_loads(payload.strip())
+            # Fail here rather than in the middle of implementing the tasks
+            _TASK_GRAPH_VALIDATOR.validate(task_graph)
+            return task_graph
+        except json.JSONDecodeError as e:
+            logger.error("Failed to parse task graph: %s", e)
+        except ValidationError as e:
+            logger.error("Task graph does not match the expected format: %s", e.message)
+        
+        logger.debug("Full response text was:\n%s", text)
+        # Return minimal valid structure
+        return {'tasks': []}
     
     def _parse_tests(self, response: Dict) -> Dict:
         """Parse test definitions from agent response"""
@@ -1,52 +1,121 @@
 """
 Configuration and logging utilities.
 """
+import os
 import yaml
 import logging
+from dataclasses import asdict, dataclass, fields
 from pathlib import Path
-from typing import Dict
+from types import MappingProxyType
+from typing import Dict, Tuple
+
+# libyaml's C parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+
+@dataclass(frozen=True, slots=True)
+class OrchestratorConfig:
+    """System configuration, as loaded from config.yaml"""
+    max_retries: int = 3
+    enable_refining: bool = False
+    coverage_threshold: float = 80.0
+    default_timeout: int = 120
+    agent_timeout: int = 300
+    test_timeout: int = 300
+    model_path: str = '/models/base-model.gguf'
+    context_size: int = 4096
+    max_tokens: int = 2048
+    temperature: float = 0.7
+    agent_cache_size: int = 128
+    agent_concurrency: int = 1
+    project_root: str = '/workspace'
+    log_level: str = 'INFO'
+    auto_commit: bool = False
+    commit_prefix: str = '[coding-buddy]'
+    
+    def __post_init__(self):
+        """Check every value against its field's type"""
+        for field in fields(self):
+            value = getattr(self, field.name)
+            # bool is a subclass of int, but "true" is no valid count
+            if isinstance(value, bool) and field.type is not bool:
+                valid = False
+            elif field.type is float and isinstance(value, int):
+                # YAML reads 80 as an int; store it as the float it stands for
+                object.__setattr__(self, field.name, float(value))
+                valid = True
+            else:
+                valid = isinstance(value, field.type)
+            if not valid:
+                raise TypeError(
+                    f"{field.name} must be {field.type.__name__}, got {type(value).__name__} {value!r}"
+                )
+        # Sizes a thread pool, which needs at least one worker
+        if self.agent_concurrency < 1:
+            raise ValueError(f"agent_concurrency must be at least 1, got {self.agent_concurrency}")
+
+
+_CONFIG_FIELDS = frozenset(field.name for field in fields(OrchestratorConfig))
 
 
 class ConfigLoader:
     """Load system configuration"""
     
-    DEFAULT_CONFIG = {
-        'max_retries': 3,
-        'enable_refining': False,
-        'coverage_threshold': 80.0,
-        'agent_timeout': 300,
-        'test_timeout': 300,
-        'model_path': '/models/base-model.gguf',
-        'context_size': 4096,
-        'max_tokens': 2048,
-        'temperature': 0.7
-    }
+    # Read-only view of the defaults, for callers that want them as a mapping
+    DEFAULT_CONFIG = MappingProxyType(asdict(OrchestratorConfig()))
+    
+    # Loaded configs by path, with the file's mtime when it was parsed
+    _cache: Dict[str, Tuple[int, OrchestratorConfig]] = {}
     
     @classmethod
-    def load(cls, config_path: str = '/app/config/config.yaml') -> Dict:
-        """Load configuration from file"""
+    def load(cls, config_path: str = '/app/config/config.yaml') -> OrchestratorConfig:
+        """
+        Load configuration from file.
+        
+        The file is only parsed again once it has been modified. Keys the
+        file leaves out keep their defaults; unknown keys are logged and
+        ignored. A value of the wrong type or out of range raises ValueError.
+        """
         try:
+            mtime = os.stat(config_path).st_mtime_ns
+            cached = cls._cache.get(config_path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            
+            # An empty file parses to None
             with open(config_path, 'r') as f:
-                config = yaml.safe_load(f)
+                config = yaml.load(f, Loader=_YamlLoader) or {}
+            
+            unknown = config.keys() - _CONFIG_FIELDS
+            if unknown:
+                logging.warning(f"Ignoring unknown config keys in {config_path}: {', '.join(sorted(unknown))}")
             
-            # Merge with defaults
-            full_config = cls.DEFAULT_CONFIG.copy()
-            full_config.update(config)
+            try:
+                full_config = OrchestratorConfig(
+                    **{key: value for key, value in config.items() if key in _CONFIG_FIELDS}
+                )
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid config in {config_path}: {e}") from e
             
+            cls._cache[config_path] = (mtime, full_config)
             return full_config
             
         except FileNotFoundError:
             logging.warning(f"Config file not found: {config_path}, using defaults")
-            return cls.DEFAULT_CONFIG
+            return OrchestratorConfig()
 
 
 def setup_logging(level: str = 'INFO'):
-    """Configure logging"""
+    """Configure logging, replacing any handlers set up by an earlier call"""
     logging.basicConfig(
         level=getattr(logging, level),
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         handlers=[
             logging.StreamHandler(),
             logging.FileHandler('/state/orchestrator.log')
-        ]
+        ],
+        force=True
     )
@@ -44,13 +44,32 @@ class GitInterface:
         # Commit
         self._run_git(['commit', '-m', message])
         
-        # Get commit hash
-        result = self._run_git(['rev-parse', 'HEAD'])
-        commit_hash = result.stdout.decode().strip()
+        commit_hash = self._head_hash()
         
         logger.info(f"Committed: {commit_hash}")
         return commit_hash
     
+    def _head_hash(self) -> str:
+        """
+        Full hash of HEAD.
+        
+        Read from the ref files git has just written, which saves starting
+        another git process; rev-parse covers layouts this does not handle
+        (packed refs, worktrees, reftable).
+        """
+        git_dir = self.project_path / '.git'
+        try:
+            head = (git_dir / 'HEAD').read_text().strip()
+            if head.startswith('ref: '):
+                head = (git_dir / head[5:]).read_text().strip()
+            if len(head) in (40, 64) and all(c in '0123456789abcdef' for c in head):
+                return head
+        except OSError:
+            pass
+        
+        result = self._run_git(['rev-parse', 'HEAD'])
+        return result.stdout.decode().strip()
+    
     def rollback(self):
         """Rollback to last committed state"""
         logger.info("Rolling back changes")
@@ -68,25 +87,18 @@ class GitInterface:
     
     def apply_patch(self, patch: str):
         """Apply a patch"""
-        import tempfile
-        
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.patch') as f:
-            f.write(patch)
-            patch_file = f.name
-        
-        try:
-            self._run_git(['apply', patch_file])
-        finally:
-            import os
-            os.unlink(patch_file)
+        # Piped to git on stdin; no temporary patch file to write and remove
+        self._run_git(['apply', '-'], input=patch.encode())
     
-    def _run_git(self, args: list, check: bool = True) -> subprocess.CompletedProcess:
-        """Run git command"""
+    def _run_git(self, args: list, check: bool = True,
+                 input: Optional[bytes] = None) -> subprocess.CompletedProcess:
+        """Run git command, optionally feeding input to its stdin"""
         cmd = ['git'] + args
         
         result = subprocess.run(
             cmd,
             cwd=self.project_path,
+            input=input,
             capture_output=True,
             check=check,
             timeout=30
@@ -1,25 +1,72 @@
+import atexit
+import copy
 import logging
+import logging.handlers
+import queue
 import sys
 from rich.logging import RichHandler
 
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Background thread that writes queued log records to the real handlers
+_listener = None
+
+
+class _PassThroughQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves exceptions for the real handlers to render.
+    
+    The stock prepare() formats the traceback into the message and drops
+    exc_info, so RichHandler could no longer render it (and would parse the
+    traceback text as markup). Only the message arguments are merged here;
+    the record stays in this process, so exc_info can travel with it.
+    """
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 def setup_logging(log_level="INFO"):
     """
     Set up logging to console and file, with support for rich markup.
+
+    Loggers only enqueue records; console and file output happen on a
+    background listener thread, so agent calls and validation never wait
+    on log I/O (DEBUG logs whole prompts and responses).
     """
+    global _listener
+
     # Remove all handlers associated with the root logger object.
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+
+    console_handler = RichHandler(rich_tracebacks=True, markup=True)
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler = logging.FileHandler("/tmp/orchestrator.log")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            RichHandler(rich_tracebacks=True, markup=True),
-            logging.FileHandler("/tmp/orchestrator.log"),
-        ],
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
     )
+    _listener.start()
+
+    logging.root.setLevel(log_level)
+    logging.root.addHandler(_PassThroughQueueHandler(log_queue))
 
     # Suppress noisy loggers
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
     logging.info("Logging initialized")
+
+
+@atexit.register
+def _stop_listener():
+    """Flush any queued records before the interpreter exits."""
+    if _listener is not None:
+        _listener.stop()
@@ -2,6 +2,7 @@
 Codebase scanner for analyzing existing projects.
 """
 import os
+import re
 from pathlib import Path
 from typing import Dict, List, Set
 import logging
@@ -10,6 +11,16 @@ import json
 
 logger = logging.getLogger(__name__)
 
+# Top-level Python definitions
+_PY_CLASS_RE = re.compile(r'^class\s+([A-Za-z_][A-Za-z0-9_]*)', re.MULTILINE)
+_PY_DEF_RE = re.compile(r'^def\s+([A-Za-z_][A-Za-z0-9_]*)', re.MULTILINE)
+_PY_IMPORT_RE = re.compile(r'^(?:from|import)\s+([\w.]+)', re.MULTILINE)
+
+# C++ includes and CMake build targets
+_CPP_INCLUDE_RE = re.compile(r'#include\s*[<"]([^>"]+)[>"]')
+_CMAKE_EXECUTABLE_RE = re.compile(r'add_executable\s*\(\s*(\w+)')
+_CMAKE_LIBRARY_RE = re.compile(r'add_library\s*\(\s*(\w+)')
+
 
 class CodebaseScanner:
     """
@@ -54,18 +65,21 @@ class CodebaseScanner:
         files = self._walk_files()
         summary['file_count'] = len(files)
         
+        # Read each source file once; every analysis below works on this
+        sources = self._read_sources(files)
+        
         # Language-specific analysis
         py_files = [f for f in files if f.suffix == '.py']
         cpp_files = [f for f in files if f.suffix in {'.cpp', '.cc', '.cxx'}]
         
         if py_files:
-            summary['modules'].extend(self._analyze_python_modules(py_files))
+            summary['modules'].extend(self._analyze_python_modules(py_files, sources))
         
         if cpp_files:
             summary['build_targets'].extend(self._analyze_cpp_targets())
         
         # Extract dependencies
-        summary['dependencies'] = self._extract_dependencies(files)
+        summary['dependencies'] = self._extract_dependencies(files, sources)
         
         logger.info(f"Scan complete: {summary['file_count']} files, "
                    f"{len(summary['modules'])} modules")
@@ -87,7 +101,21 @@ class CodebaseScanner:
         
         return files
     
-    def _analyze_python_modules(self, py_files: List[Path]) -> List[Dict]:
+    def _read_sources(self, files: List[Path]) -> Dict[Path, str]:
+        """Read source files, skipping any that cannot be read"""
+        sources = {}
+        
+        for file in files:
+            try:
+                with open(file, 'r') as f:
+                    sources[file] = f.read()
+            except Exception as e:
+                logger.warning(f"Failed to read {file}: {e}")
+        
+        return sources
+    
+    def _analyze_python_modules(self, py_files: List[Path],
+                                sources: Dict[Path, str]) -> List[Dict]:
         """Extract Python module information"""
         modules = []
         
@@ -96,7 +124,7 @@ class CodebaseScanner:
             module_name = str(relative_path.with_suffix('')).replace(os.sep, '.')
             
             # Extract public API (classes and functions)
-            api = self._extract_python_api(py_file)
+            api = self._extract_python_api(sources.get(py_file, ''))
             
             modules.append({
                 'name': module_name,
@@ -106,28 +134,10 @@ class CodebaseScanner:
         
         return modules
     
-    def _extract_python_api(self, py_file: Path) -> List[str]:
+    def _extract_python_api(self, content: str) -> List[str]:
         """Extract public classes and functions from Python file"""
-        api = []
-        
-        try:
-            with open(py_file, 'r') as f:
-                content = f.read()
-            
-            # Simple regex-based extraction (can be enhanced with AST)
-            import re
-            
-            # Find class definitions
-            classes = re.findall(r'^class\s+([A-Za-z_][A-Za-z0-9_]*)', content, re.MULTILINE)
-            api.extend([f"class {c}" for c in classes if not c.startswith('_')])
-            
-            # Find function definitions
-            functions = re.findall(r'^def\s+([A-Za-z_][A-Za-z0-9_]*)', content, re.MULTILINE)
-            api.extend([f"def {f}" for f in functions if not f.startswith('_')])
-            
-        except Exception as e:
-            logger.warning(f"Failed to parse {py_file}: {e}")
-        
+        api = [f"class {c}" for c in _PY_CLASS_RE.findall(content) if not c.startswith('_')]
+        api.extend(f"def {f}" for f in _PY_DEF_RE.findall(content) if not f.startswith('_'))
         return api
     
     def _analyze_cpp_targets(self) -> List[Dict]:
@@ -142,9 +152,8 @@ class CodebaseScanner:
                     content = f.read()
                 
                 # Extract add_executable and add_library calls
-                import re
-                executables = re.findall(r'add_executable\s*\(\s*(\w+)', content)
-                libraries = re.findall(r'add_library\s*\(\s*(\w+)', content)
+                executables = _CMAKE_EXECUTABLE_RE.findall(content)
+                libraries = _CMAKE_LIBRARY_RE.findall(content)
                 
                 for exe in executables:
                     targets.append({'name': exe, 'type': 'executable'})
@@ -157,27 +166,26 @@ class CodebaseScanner:
         
         return targets
     
-    def _extract_dependencies(self, files: List[Path]) -> Dict[str, List[str]]:
+    def _extract_dependencies(self, files: List[Path],
+                              sources: Dict[Path, str]) -> Dict[str, List[str]]:
         """Build dependency graph"""
         dependencies = {}
         
         for file in files:
             deps = set()
+            content = sources.get(file)
+            if content is None:
+                continue
             
             try:
-                with open(file, 'r') as f:
-                    content = f.read()
-                
                 if file.suffix == '.py':
                     # Extract Python imports
-                    import re
-                    imports = re.findall(r'^(?:from|import)\s+([\w.]+)', content, re.MULTILINE)
+                    imports = _PY_IMPORT_RE.findall(content)
                     deps.update(imports)
                 
                 elif file.suffix in {'.cpp', '.cc', '.cxx', '.hpp', '.h'}:
                     # Extract C++ includes
-                    import re
-                    includes = re.findall(r'#include\s*[<"]([^>"]+)[>"]', content)
+                    includes = _CPP_INCLUDE_RE.findall(content)
                     deps.update(includes)
                 
                 if deps:
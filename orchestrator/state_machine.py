@@ -4,13 +4,15 @@ State machine implementation for orchestrating the coding workflow.
 from enum import Enum
 from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Set
 import json
 import re
 import logging
 from datetime import datetime
 from pprint import pformat
 
+from .config_loader import OrchestratorConfig
+
 logger = logging.getLogger(__name__)
 
 
@@ -67,11 +69,12 @@ class StateMachine:
     MAX_RETRIES = 3
     STATE_FILE = "/state/workflow_state.json"
     
-    def __init__(self, project_path: Path, config: Dict, auto_commit: bool = False):
+    def __init__(self, project_path: Path, config: OrchestratorConfig, auto_commit: bool = False):
         self.project_path = project_path
         self.config = config
         self.auto_commit = auto_commit
         self.state = WorkflowState(current_state=State.IDLE)
+        self._agents_client = None
         
     def execute(self, request: str) -> ExecutionResult:
         """
@@ -97,73 +100,29 @@ class StateMachine:
             self._transition_to(State.TEST_AUTHORING)
             tests = self._author_tests(task_graph)
             
-            # Process each task
-            for task in task_graph['tasks']:
-                self.state.current_task = task['id']
-                self.state.retry_count = 0
+            # Process tasks in waves: the tasks at the front whose dependencies
+            # are all done get their first implementation concurrently, then
+            # each is validated (and retried if needed) in order
+            tasks = task_graph['tasks']
+            done = set()
+            next_task = 0
+            while next_task < len(tasks):
+                wave = self._ready_tasks(tasks[next_task:], done)
+                next_task += len(wave)
                 
-                while self.state.retry_count < self.MAX_RETRIES:
-                    self._transition_to(State.IMPLEMENTING)
-                    code_diff = self._implement(task)
-                    
-                    self._transition_to(State.VALIDATING)
-                    validation_result = self._validate(code_diff, tests)
-                    
-                    if validation_result.get('is_patch_failure'):
-                        logger.warning("Patch application failed for task %s. Gathering context and retrying...", task['id'])
-                        
-                        # --- CONTEXT GATHERING LOGIC FOR ALL FILES ---
-                        file_contexts_for_feedback = []
-                        # Parse all file headers from the diff
-                        file_headers = re.findall(r'^\+\+\+\s+b/(?P<filename>\S+)', code_diff, re.MULTILINE)
-                        
-                        for filename in file_headers:
-                            target_file = self.project_path / filename
-                            file_info = {'filename': filename}
-                            
-                            if target_file.exists():
-                                content = target_file.read_text()
-                                file_info['exists'] = True
-                                file_info['content'] = content
-                                file_info['num_lines'] = len(content.splitlines())
-                            else:
-                                file_info['exists'] = False
-                                file_info['content'] = "(File does not exist)"
-                                file_info['num_lines'] = 0
-                                
-                            file_contexts_for_feedback.append(file_info)
-
-                        self.state.retry_count += 1
-                        if self.state.retry_count >= self.MAX_RETRIES:
-                            self._transition_to(State.ROLLBACK)
-                            self._rollback()
-                            raise Exception(f"Task {task['id']} failed to apply patch after {self.MAX_RETRIES} retries")
-                        
-                        task['feedback'] = {
-                            'patch_error': validation_result['failures'][0],
-                            'broken_diff': code_diff,
-                            'file_contexts': file_contexts_for_feedback
-                        }
-                        # Continue the while loop to retry with the new context
-                        continue
-                    
-                    if validation_result['passed']:
-                        logger.info("Task %s passed validation.", task['id'])
-                        break
-                    else:
-                        logger.warning("Task %s failed validation (non-patch-related). Retrying...", task['id'])
-                        self.state.retry_count += 1
-                        if self.state.retry_count >= self.MAX_RETRIES:
-                            self._transition_to(State.ROLLBACK)
-                            self._rollback()
-                            raise Exception(f"Task {task['id']} failed after {self.MAX_RETRIES} retries")
-                        
-                        self._transition_to(State.REVIEW)
-                        suggestions = self._review(validation_result)
-                        task['suggestions'] = suggestions
+                self._transition_to(State.IMPLEMENTING)
+                if len(wave) > 1 and self.config.agent_concurrency > 1:
+                    logger.info("Implementing tasks %s concurrently", ", ".join(str(t['id']) for t in wave))
+                    first_diffs = self._agents().implement_many(wave)
+                else:
+                    first_diffs = [None] * len(wave)
+                
+                for task, first_diff in zip(wave, first_diffs):
+                    self._run_task(task, tests, first_diff)
+                    done.add(str(task['id']))
             
             # Refine if configured
-            if self.config.get('enable_refining', False):
+            if self.config.enable_refining:
                 self._transition_to(State.REFINING)
                 refined_diff = self._refine()
                 
@@ -200,6 +159,99 @@ class StateMachine:
                 error=str(e),
                 metrics=self.state.metrics
             )
+        finally:
+            # Release pooled runtime connections; a later run opens a new client
+            if self._agents_client is not None:
+                self._agents_client.close()
+                self._agents_client = None
+    
+    def _ready_tasks(self, pending: List[Dict], done: Set[str]) -> List[Dict]:
+        """
+        Leading tasks of pending that only depend on tasks already done.
+        
+        A task whose dependencies are not done yet (or not in the graph)
+        is run on its own, in order, as it always was.
+        """
+        wave = []
+        for task in pending:
+            dependencies = {str(dep) for dep in task.get('dependencies') or []}
+            if not dependencies <= done:
+                break
+            wave.append(task)
+        return wave or pending[:1]
+    
+    def _run_task(self, task: Dict, tests: Dict, code_diff: Optional[str] = None):
+        """
+        Implement and validate one task, retrying until it passes.
+        
+        Args:
+            task: Task from the task graph
+            tests: Tests from the Spec Author
+            code_diff: Already generated first implementation, if any
+        """
+        self.state.current_task = task['id']
+        self.state.retry_count = 0
+        
+        while self.state.retry_count < self.MAX_RETRIES:
+            self._transition_to(State.IMPLEMENTING)
+            if code_diff is None:
+                code_diff = self._implement(task)
+            
+            self._transition_to(State.VALIDATING)
+            validation_result = self._validate(code_diff, tests)
+            
+            if validation_result.get('is_patch_failure'):
+                logger.warning("Patch application failed for task %s. Gathering context and retrying...", task['id'])
+                
+                # --- CONTEXT GATHERING LOGIC FOR ALL FILES ---
+                file_contexts_for_feedback = []
+                # Parse all file headers from the diff
+                file_headers = re.findall(r'^\+\+\+\s+b/(?P<filename>\S+)', code_diff, re.MULTILINE)
+                
+                for filename in file_headers:
+                    target_file = self.project_path / filename
+                    file_info = {'filename': filename}
+                    
+                    # The prompt builder reads the file, and only as
+                    # much of it as it will use
+                    if target_file.exists():
+                        file_info['exists'] = True
+                        file_info['path'] = str(target_file)
+                    else:
+                        file_info['exists'] = False
+                        
+                    file_contexts_for_feedback.append(file_info)
+
+                self.state.retry_count += 1
+                if self.state.retry_count >= self.MAX_RETRIES:
+                    self._transition_to(State.ROLLBACK)
+                    self._rollback()
+                    raise Exception(f"Task {task['id']} failed to apply patch after {self.MAX_RETRIES} retries")
+                
+                task['feedback'] = {
+                    'patch_error': validation_result['failures'][0],
+                    'broken_diff': code_diff,
+                    'file_contexts': file_contexts_for_feedback
+                }
+                # Continue the while loop to retry with the new context
+                code_diff = None
+                continue
+            
+            if validation_result['passed']:
+                logger.info("Task %s passed validation.", task['id'])
+                break
+            else:
+                logger.warning("Task %s failed validation (non-patch-related). Retrying...", task['id'])
+                self.state.retry_count += 1
+                if self.state.retry_count >= self.MAX_RETRIES:
+                    self._transition_to(State.ROLLBACK)
+                    self._rollback()
+                    raise Exception(f"Task {task['id']} failed after {self.MAX_RETRIES} retries")
+                
+                self._transition_to(State.REVIEW)
+                suggestions = self._review(validation_result)
+                task['suggestions'] = suggestions
+                code_diff = None
     
     def _transition_to(self, new_state: State):
         """Transition to a new state"""
@@ -214,23 +266,29 @@ class StateMachine:
         scanner = CodebaseScanner(self.project_path)
         return scanner.scan()
     
+    def _agents(self):
+        """Agent runtime client, shared by all agent calls so connections are reused"""
+        if self._agents_client is None:
+            from .agents_client import AgentsClient
+            self._agents_client = AgentsClient(
+                temperature=self.config.temperature,
+                cache_size=self.config.agent_cache_size,
+                concurrency=self.config.agent_concurrency,
+                timeout=self.config.agent_timeout
+            )
+        return self._agents_client
+    
     def _plan(self, request: str, codebase_summary: Dict) -> Dict:
         """Generate task graph using Architect agent"""
-        from .agents_client import AgentsClient
-        client = AgentsClient()
-        return client.plan(request, codebase_summary)
+        return self._agents().plan(request, codebase_summary)
     
     def _author_tests(self, task_graph: Dict) -> Dict:
         """Generate tests using Spec Author agent"""
-        from .agents_client import AgentsClient
-        client = AgentsClient()
-        return client.author_tests(task_graph)
+        return self._agents().author_tests(task_graph)
     
     def _implement(self, task: Dict) -> str:
         """Implement task using Implementer agent"""
-        from .agents_client import AgentsClient
-        client = AgentsClient()
-        return client.implement(task)
+        return self._agents().implement(task)
     
     def _validate(self, code_diff: str, tests: Dict) -> Dict:
         """Run tests and quality gates"""
@@ -242,15 +300,11 @@ class StateMachine:
 
     def _review(self, validation_result: Dict) -> Dict:
         """Get suggestions from Reviewer agent"""
-        from .agents_client import AgentsClient
-        client = AgentsClient()
-        return client.review(validation_result)
+        return self._agents().review(validation_result)
     
     def _refine(self) -> str:
         """Refine code using Refiner agent"""
-        from .agents_client import AgentsClient
-        client = AgentsClient()
-        return client.refine()
+        return self._agents().refine()
     
     def _rollback(self):
         """Revert changes"""
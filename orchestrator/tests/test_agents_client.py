@@ -0,0 +1,246 @@
+import pytest
+import requests
+
+from orchestrator.agents_client import AgentsClient
+
+
+TASK_GRAPH_JSON = """{
+  "language": "python",
+  "tasks": [
+    {"id": 1, "description": "Add a subtract function", "acceptance_criteria": ["subtract(3, 1) == 2"]}
+  ]
+}"""
+
+
+def test_parse_task_graph_closed_fence():
+    client = AgentsClient(base_url="http://agents.invalid")
+    text = f"Here is the plan:\n```json\n{TASK_GRAPH_JSON}\n```\n\nDone."
+
+    task_graph = client._parse_task_graph({'text': text})
+
+    assert [task['id'] for task in task_graph['tasks']] == [1]
+
+
+def test_parse_task_graph_cut_at_stop_sequence():
+    # The runtime strips the stop sequence, so the closing fence never arrives
+    client = AgentsClient(base_url="http://agents.invalid")
+    text = f"Here is the plan:\n```json\n{TASK_GRAPH_JSON}"
+
+    task_graph = client._parse_task_graph({'text': text})
+
+    assert [task['id'] for task in task_graph['tasks']] == [1]
+
+
+def test_parse_task_graph_rejects_malformed_dependencies():
+    client = AgentsClient(base_url="http://agents.invalid")
+    text = ('{"tasks": [{"id": 2, "description": "Use subtract", '
+            '"acceptance_criteria": [], "dependencies": 1}]}')
+
+    assert client._parse_task_graph({'text': text}) == {'tasks': []}
+
+
+def _numbered_file(count):
+    return "".join(f"line {number}\n" for number in range(1, count + 1))
+
+
+def _excerpt_line_numbers(excerpts):
+    return [int(line.split('|')[0]) for line in excerpts.splitlines() if '|' in line]
+
+
+def test_diff_hunks_collects_original_lines():
+    client = AgentsClient(base_url="http://agents.invalid")
+    diff = (
+        "--- a/app.py\n"
+        "+++ b/app.py\n"
+        "@@ -10,3 +10,3 @@\n"
+        " line 10\n"
+        "-line 11\n"
+        "+line eleven\n"
+        " line 12\n"
+    )
+
+    assert client._diff_hunks(diff) == {'app.py': [(10, 3, ['line 10', 'line 11', 'line 12'])]}
+
+
+def test_file_excerpts_around_located_hunk():
+    client = AgentsClient(base_url="http://agents.invalid")
+    content = _numbered_file(200)
+
+    excerpts = client._file_excerpts(content, [(100, 2, ['line 100', 'line 101'])], context=5)
+
+    assert _excerpt_line_numbers(excerpts) == list(range(95, 107))
+    assert excerpts.startswith("...\n") and excerpts.endswith("...\n")
+
+
+def test_locate_hunk_with_wrong_line_numbers():
+    # The hunk claims line 10, but its lines are at 50-52
+    client = AgentsClient(base_url="http://agents.invalid")
+    lines = _numbered_file(200).splitlines()
+
+    assert client._locate_hunk(lines, 10, ['line 50', 'line 51', 'line 52']) == 50
+
+
+def test_file_excerpts_merges_overlapping_windows():
+    client = AgentsClient(base_url="http://agents.invalid")
+    content = _numbered_file(200)
+    hunks = [(100, 1, ['line 100']), (106, 1, ['line 106'])]
+
+    excerpts = client._file_excerpts(content, hunks, context=5)
+
+    assert _excerpt_line_numbers(excerpts) == list(range(95, 112))
+    assert excerpts.count("...\n") == 2
+
+
+def test_file_excerpts_skips_hunk_past_end_of_file():
+    client = AgentsClient(base_url="http://agents.invalid")
+    content = _numbered_file(200)
+
+    assert client._file_excerpts(content, [(1000, 2, ['not in file'])], context=5) == ''
+
+
+def test_patch_retry_prompt_shows_head_when_hunks_are_past_truncation(tmp_path):
+    client = AgentsClient(base_url="http://agents.invalid")
+    client.MAX_CONTEXT_FILE_BYTES = 10_000
+    path = tmp_path / "big.py"
+    path.write_text(_numbered_file(5000))
+    task = {
+        'description': 'Change the last line',
+        'acceptance_criteria': [],
+        'feedback': {
+            'patch_error': 'Hunk #1 FAILED at 4999.',
+            'file_contexts': [{'filename': 'big.py', 'path': str(path), 'exists': True}],
+            'broken_diff': "--- a/big.py\n+++ b/big.py\n@@ -4999,1 +4999,1 @@\n-line 4999\n+line last\n",
+        },
+    }
+
+    prompt = client._build_implementer_prompt(task)
+
+    assert "START FILE EXCERPTS" in prompt
+    assert "     1| line 1\n" in prompt
+    assert "line 1000\n" not in prompt
+
+
+def test_read_until_fenced_block_fence_split_across_chunks():
+    client = AgentsClient(base_url="http://agents.invalid")
+    chunks = ["Plan:\n`", "``json\n{}\n`", "`", "`\n", "never read"]
+
+    assert client._read_until_fenced_block(chunks) == "Plan:\n```json\n{}\n```\n"
+
+
+def test_read_until_fenced_block_unterminated_fence():
+    client = AgentsClient(base_url="http://agents.invalid")
+    chunks = ["```diff\n", "--- a/app.py\n", "+++ b/app.py\n"]
+
+    assert client._read_until_fenced_block(chunks) == "```diff\n--- a/app.py\n+++ b/app.py\n"
+
+
+def test_read_until_fenced_block_stops_after_closing_fence():
+    client = AgentsClient(base_url="http://agents.invalid")
+    consumed = []
+
+    def chunks():
+        for chunk in ["```\ncode\n", "```\nThat's all", " folks", "!"]:
+            consumed.append(chunk)
+            yield chunk
+
+    # Text in the closing chunk is kept; later chunks are never requested
+    assert client._read_until_fenced_block(chunks()) == "```\ncode\n```\nThat's all"
+    assert consumed == ["```\ncode\n", "```\nThat's all"]
+
+
+def _response(status_code, body=b'{"text": "ok", "metadata": {}}'):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.url = "http://agents.invalid/generate"
+    return response
+
+
+class FakeSession:
+    """Stands in for the client's requests.Session, answering each post in turn"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        pass
+
+
+def _client_with(session, **kwargs):
+    client = AgentsClient(base_url="http://agents.invalid", **kwargs)
+    client._session = session
+    return client
+
+
+def test_circuit_opens_after_consecutive_connection_failures():
+    session = FakeSession(requests.exceptions.ConnectionError("refused"))
+    client = _client_with(session)
+
+    for _ in range(client.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client._call_agent('implementer', 'prompt')
+
+    with pytest.raises(requests.exceptions.ConnectionError, match="unavailable"):
+        client._call_agent('implementer', 'prompt')
+    # Refused locally, without reaching the runtime
+    assert session.posts == client.CIRCUIT_FAILURE_THRESHOLD
+
+
+def test_circuit_ignores_client_errors():
+    session = FakeSession(_response(429, b'{"detail": "busy"}'))
+    client = _client_with(session)
+
+    for _ in range(client.CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(requests.exceptions.HTTPError):
+            client._call_agent('implementer', 'prompt')
+
+    assert session.posts == client.CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+def test_success_resets_failure_streak():
+    failures = [_response(503)] * (AgentsClient.CIRCUIT_FAILURE_THRESHOLD - 1)
+    session = FakeSession(*failures, _response(200), _response(503), _response(200))
+    client = _client_with(session)
+
+    for _ in failures:
+        with pytest.raises(requests.exceptions.HTTPError):
+            client._call_agent('implementer', 'prompt')
+    client._call_agent('implementer', 'prompt')
+    with pytest.raises(requests.exceptions.HTTPError):
+        client._call_agent('implementer', 'prompt')
+
+    assert client._call_agent('implementer', 'prompt')['text'] == 'ok'
+
+
+def test_deterministic_calls_are_cached_least_recently_used_first():
+    session = FakeSession(_response(200))
+    client = _client_with(session, cache_size=2)
+
+    client._call_agent('implementer', 'a', temperature=0)
+    client._call_agent('implementer', 'b', temperature=0)
+    client._call_agent('implementer', 'a', temperature=0)
+    # Evicts "b", the least recently used
+    client._call_agent('implementer', 'c', temperature=0)
+    client._call_agent('implementer', 'a', temperature=0)
+    client._call_agent('implementer', 'b', temperature=0)
+
+    assert session.posts == 4
+    assert client.stats == {'cache_hits': 2, 'cache_misses': 4}
+
+
+def test_sampled_calls_are_not_cached():
+    session = FakeSession(_response(200))
+    client = _client_with(session)
+
+    client._call_agent('implementer', 'a', temperature=0.7)
+    client._call_agent('implementer', 'a', temperature=0.7)
+
+    assert session.posts == 2
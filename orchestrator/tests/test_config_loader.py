@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from orchestrator.config_loader import ConfigLoader, OrchestratorConfig
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(ConfigLoader, '_cache', {})
+
+
+def test_config_rejects_wrong_type():
+    with pytest.raises(TypeError, match="max_retries must be int"):
+        OrchestratorConfig(max_retries="3")
+
+
+def test_config_rejects_bool_for_number():
+    with pytest.raises(TypeError, match="agent_cache_size must be int"):
+        OrchestratorConfig(agent_cache_size=True)
+
+
+def test_config_rejects_non_bool_flag():
+    with pytest.raises(TypeError, match="auto_commit must be bool"):
+        OrchestratorConfig(auto_commit="yes")
+
+
+def test_config_stores_int_as_float():
+    config = OrchestratorConfig(coverage_threshold=80)
+
+    assert config.coverage_threshold == 80.0
+    assert isinstance(config.coverage_threshold, float)
+
+
+def test_config_rejects_zero_concurrency():
+    with pytest.raises(ValueError, match="agent_concurrency"):
+        OrchestratorConfig(agent_concurrency=0)
+
+
+def test_load_reports_invalid_value(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("max_retries: three\n")
+
+    with pytest.raises(ValueError, match="Invalid config in"):
+        ConfigLoader.load(str(path))
+
+
+def test_load_missing_file_uses_defaults(tmp_path):
+    assert ConfigLoader.load(str(tmp_path / "missing.yaml")) == OrchestratorConfig()
+
+
+def test_load_reuses_config_until_file_changes(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("max_retries: 5\n")
+
+    first = ConfigLoader.load(str(path))
+    assert ConfigLoader.load(str(path)) is first
+
+    path.write_text("max_retries: 7\n")
+    # Set the mtime explicitly; two writes can fall within one timestamp tick
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert ConfigLoader.load(str(path)).max_retries == 7
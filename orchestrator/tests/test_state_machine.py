@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from orchestrator.config_loader import OrchestratorConfig
+from orchestrator.state_machine import StateMachine
+
+
+def _ids(tasks):
+    return [task['id'] for task in tasks]
+
+
+def _machine():
+    return StateMachine(Path('.'), OrchestratorConfig())
+
+
+def test_ready_tasks_takes_leading_independent_tasks():
+    tasks = [
+        {'id': 1},
+        {'id': 2, 'dependencies': []},
+        {'id': 3, 'dependencies': [1]},
+        {'id': 4},
+    ]
+
+    assert _ids(_machine()._ready_tasks(tasks, set())) == [1, 2]
+
+
+def test_ready_tasks_after_dependencies_are_done():
+    tasks = [{'id': 3, 'dependencies': [1, '2']}, {'id': 4, 'dependencies': [3]}]
+
+    # Ids are compared as strings, whatever type the plan used
+    assert _ids(_machine()._ready_tasks(tasks, {'1', '2'})) == [3]
+
+
+def test_ready_tasks_runs_blocked_task_alone():
+    # A dependency missing from the graph never completes; the task still runs, in order
+    tasks = [{'id': 2, 'dependencies': [99]}, {'id': 3}]
+
+    assert _ids(_machine()._ready_tasks(tasks, set())) == [2]
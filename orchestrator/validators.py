@@ -8,9 +8,13 @@ from pathlib import Path
 from typing import Dict, List
 import tempfile
 import os
+import re
 
 logger = logging.getLogger(__name__)
 
+# New-file header line; every unified diff has at least one
+_DIFF_HEADER_RE = re.compile(r'^\+\+\+\s', re.MULTILINE)
+
 
 class Validator:
     """
@@ -88,6 +92,12 @@ class Validator:
         Apply unified diff to project.
         Returns an error string on failure, or None on success.
         """
+        # Reject output that is not a diff at all without spawning patch
+        if not _DIFF_HEADER_RE.search(diff):
+            error_message = "Failed to apply diff: no unified diff file header ('+++ ') found"
+            logger.error(error_message)
+            return error_message
+        
         patch_file = None
         try:
             # Write diff to temp file
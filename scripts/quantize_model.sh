@@ -0,0 +1,38 @@
+#!/bin/bash
+# Convert an F16/F32 GGUF model to a K-quant for CPU inference
+#
+# Usage: scripts/quantize_model.sh <input.gguf> [QUANT]
+#
+# QUANT defaults to Q4_K_M. The output is written to
+# models/base-model.<QUANT>.gguf; start the runtime with MODEL_QUANT=<QUANT>
+# to load it.
+
+set -e
+
+INPUT="$1"
+QUANT="${2:-Q4_K_M}"
+QUANTIZE="${LLAMA_QUANTIZE:-llama-quantize}"
+
+if [ -z "$INPUT" ]; then
+    echo "Usage: $0 <input.gguf> [QUANT]"
+    exit 1
+fi
+
+if [ ! -f "$INPUT" ]; then
+    echo "Error: $INPUT not found"
+    exit 1
+fi
+
+if ! command -v "$QUANTIZE" &> /dev/null; then
+    echo "Error: $QUANTIZE not found (build llama.cpp or set LLAMA_QUANTIZE)"
+    exit 1
+fi
+
+OUTPUT="models/base-model.${QUANT}.gguf"
+mkdir -p models
+
+echo "Quantizing $INPUT to $QUANT..."
+"$QUANTIZE" "$INPUT" "$OUTPUT" "$QUANT"
+
+echo "✓ Wrote $OUTPUT ($(du -h "$OUTPUT" | cut -f1))"
+echo "  Start the runtime with MODEL_QUANT=$QUANT to use it"